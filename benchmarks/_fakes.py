@@ -0,0 +1,195 @@
+# coding=utf-8
+"""
+In-process stand-ins for what OctoPrint injects into the plugin, shared by the benchmarks.
+
+``make_plugin`` returns a ``TasmotaMQTTPlugin`` wired to fake settings, plugin manager, printer and MQTT
+helpers, so the plugin's hot paths can be driven without OctoPrint running, a broker or any hardware.
+"""
+from __future__ import absolute_import
+
+import atexit
+import copy
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import octoprint_tasmota_mqtt
+from octoprint_tasmota_mqtt import TasmotaMQTTPlugin
+
+FULL_TOPIC_PATTERN = "%topic%/%prefix%/"
+
+# every fake plugin gets its own data folder below this one, removed again when the run ends
+_DATA_ROOT = tempfile.mkdtemp(prefix="tasmota_mqtt_bench")
+atexit.register(shutil.rmtree, _DATA_ROOT, True)
+
+
+class FakeSettings(object):
+	"""Plugin settings backed by a dict, counts how often the plugin writes and saves them."""
+
+	def __init__(self, data):
+		self._data = data
+		self.folder = tempfile.mkdtemp(dir=_DATA_ROOT)
+		self.sets = 0
+		self.saves = 0
+
+	def get(self, path, **kwargs):
+		if not path:
+			return copy.deepcopy(self._data)
+		return copy.deepcopy(self._data[path[0]])
+
+	def get_int(self, path, **kwargs):
+		return int(self._data[path[0]])
+
+	def get_float(self, path, **kwargs):
+		return float(self._data[path[0]])
+
+	def get_boolean(self, path, **kwargs):
+		return bool(self._data[path[0]])
+
+	def get_all_data(self, **kwargs):
+		return copy.deepcopy(self._data)
+
+	def set(self, path, value, **kwargs):
+		self.sets += 1
+		if not path:
+			self._data.update(value)
+		else:
+			self._data[path[0]] = value
+
+	set_int = set_float = set_boolean = set
+
+	def clean_all_data(self, **kwargs):
+		pass
+
+	def save(self, *args, **kwargs):
+		self.saves += 1
+
+	def get_plugin_logfile_path(self, postfix=None):
+		return os.path.join(self.folder, "plugin_tasmota_mqtt_{}.log".format(postfix))
+
+
+class FakePluginManager(object):
+	def __init__(self, helpers):
+		self._helpers = helpers
+		self.messages = 0
+
+	def send_plugin_message(self, identifier, data):
+		self.messages += 1
+
+	def get_helpers(self, name, *helpers):
+		return self._helpers
+
+
+class FakePrinter(object):
+	def __init__(self):
+		self.temperatures = {}
+
+	def is_printing(self):
+		return False
+
+	def is_paused(self):
+		return False
+
+	def is_ready(self):
+		return True
+
+	def is_closed_or_error(self):
+		return False
+
+	def connect(self, *args, **kwargs):
+		pass
+
+	def disconnect(self, *args, **kwargs):
+		pass
+
+	def get_current_temperatures(self):
+		return self.temperatures
+
+	def set_temperature(self, heater, value):
+		pass
+
+	def register_callback(self, callback):
+		pass
+
+	def unregister_callback(self, callback):
+		pass
+
+
+class FakeMQTT(object):
+	"""The MQTT plugin's helpers, counting publishes and keeping the subscriptions."""
+
+	def __init__(self):
+		self.published = 0
+		self.subscriptions = []
+
+	def publish(self, topic, payload, *args, **kwargs):
+		self.published += 1
+
+	def subscribe(self, topic, callback, args=None, kwargs=None):
+		self.subscriptions.append((topic, callback))
+
+	def unsubscribe(self, callback, topic=None):
+		self.subscriptions = [(t, c) for t, c in self.subscriptions if c != callback or (topic is not None and t != topic)]
+
+	def helpers(self):
+		return dict(mqtt_publish=self.publish, mqtt_subscribe=self.subscribe, mqtt_unsubscribe=self.unsubscribe)
+
+
+class _AllowAll(object):
+	def can(self):
+		return True
+
+
+class _Permissions(object):
+	PLUGIN_TASMOTA_MQTT_CONTROL = _AllowAll()
+
+
+def relay(index, relays_per_device=4, **overrides):
+	"""A relay with every field the relay editor creates, ``relays_per_device`` relays share a topic."""
+	result = dict(topic="printer{}".format(index // relays_per_device),
+				  relayN="{}".format(index % relays_per_device + 1) if relays_per_device > 1 else "",
+				  icon="icon-bolt", label="", groups="", powerOnPriority=0, currentstate="UNKNOWN", invertedLogic=False,
+				  showInNavbar=True, warn=True, warnPrinting=False, gcode=False, gcodeOnDelay=0, gcodeOffDelay=0,
+				  connect=False, connectOnDelay=15, disconnect=False, disconnectOffDelay=0, disconnectAutoOffDelay=30,
+				  sysCmdOn=False, sysCmdRunOn="", sysCmdOnDelay=0, sysCmdOff=False, sysCmdRunOff="", sysCmdOffDelay=0,
+				  automaticShutdownEnabled=False, errorEvent=False, event_on_upload=False, event_on_startup=False,
+				  event_on_connect=False, event_on_disconnect=False)
+	result.update(overrides)
+	return result
+
+
+def make_plugin(relays, startup=True, **settings):
+	"""
+	Creates a plugin with ``relays`` relays (a count or a list of relay dicts) and optional settings overrides.
+
+	Returns the plugin and its ``FakeMQTT``. With ``startup`` the plugin is also taken through
+	``on_after_startup``, which subscribes the relays.
+	"""
+	# the api permission check needs a logged in user otherwise
+	octoprint_tasmota_mqtt.Permissions = _Permissions()
+
+	if not isinstance(relays, list):
+		relays = [relay(i) for i in range(relays)]
+
+	plugin = TasmotaMQTTPlugin()
+	plugin._tasmota_mqtt_logger.setLevel(logging.INFO)
+	data = plugin.get_settings_defaults()
+	data["full_topic_pattern"] = FULL_TOPIC_PATTERN
+	data["arrRelays"] = relays
+	data.update(settings)
+
+	mqtt = FakeMQTT()
+	plugin._settings = FakeSettings(data)
+	plugin._data_folder = plugin._settings.folder
+	plugin._plugin_manager = FakePluginManager(mqtt.helpers())
+	plugin._printer = FakePrinter()
+	plugin._identifier = "tasmota_mqtt"
+	plugin.powerOffWhenIdle = data["powerOffWhenIdle"]
+	plugin.on_settings_initialized()
+	if startup:
+		plugin.on_after_startup()
+	return plugin, mqtt
@@ -0,0 +1,73 @@
+# coding=utf-8
+"""
+Micro-benchmark for the ``octoprint.comm.protocol.gcode.queuing`` hook.
+
+Feeds a typical print stream through ``TasmotaMQTTPlugin.processGCODE`` and reports lines per second next to
+an empty hook of the same signature, so the overhead the plugin adds to streaming can be read off directly.
+
+Usage: python benchmarks/gcode_hook.py [--lines N] [--relays N] [--repeat N]
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _fakes import make_plugin, relay
+
+STREAM = [
+	("G1 X10.5 Y20.3 E0.4", "G1"),
+	("G1 X11.2 Y20.9 E0.41", "G1"),
+	("G1 X12.0 Y21.4 E0.42", "G1"),
+	("M105", "M105"),
+	("G0 F9000 X50 Y50", "G0"),
+	("G1 Z0.3", "G1"),
+	("M106 S255", "M106"),
+	("G1 X13.1 Y22.0 E0.43", "G1"),
+]
+
+
+def _plugin(relays, gcode, power_off_when_idle):
+	plugin, _ = make_plugin([relay(i, relays_per_device=1, gcode=gcode) for i in range(relays)], startup=False,
+							powerOffWhenIdle=power_off_when_idle, idleIgnoreCommands="M105,M155")
+	return plugin
+
+
+def measure(hook, lines, repeat):
+	stream = (STREAM * (lines // len(STREAM) + 1))[:lines]
+
+	def run():
+		for cmd, gcode in stream:
+			hook(None, "queuing", cmd, None, gcode)
+
+	best = min(timeit.repeat(run, number=1, repeat=repeat))
+	return lines / best
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument("--lines", type=int, default=200000)
+	parser.add_argument("--relays", type=int, default=10)
+	parser.add_argument("--repeat", type=int, default=5)
+	args = parser.parse_args()
+
+	def empty_hook(comm_instance, phase, cmd, cmd_type, gcode, *args, **kwargs):
+		return
+
+	cases = [
+		("empty hook", empty_hook),
+		("inactive (no gcode relays, no auto off)", _plugin(args.relays, False, False).processGCODE),
+		("gcode relays enabled", _plugin(args.relays, True, False).processGCODE),
+		("gcode relays + auto power off", _plugin(args.relays, True, True).processGCODE),
+	]
+
+	print("{} lines, {} relays, best of {}".format(args.lines, args.relays, args.repeat))
+	for name, hook in cases:
+		print("{:<45} {:>14,.0f} lines/s".format(name, measure(hook, args.lines, args.repeat)))
+
+
+if __name__ == "__main__":
+	main()
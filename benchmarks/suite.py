@@ -0,0 +1,139 @@
+# coding=utf-8
+"""
+Benchmark suite for the plugin's hot paths at different relay counts.
+
+Runs against the in-process fakes in ``_fakes.py``, no OctoPrint server, broker or hardware needed, and
+writes a JSON report with one entry per benchmark and relay count:
+
+- ``gcode_hook``: ``processGCODE`` throughput in lines/s, inactive, with gcode relays and with auto power off
+- ``stat_messages``: ``_on_mqtt_subscription`` throughput in messages/s
+- ``check_status``: publishes caused by a cold and a warm ``checkStatus`` and the time per call, per polling mode
+- ``settings``: time per settings save and how often the plugin itself saved settings during a session
+
+Usage: python benchmarks/suite.py [--relays 1,10,100,500] [--repeat N] [--only NAME,...] [--output report.json]
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _fakes import make_plugin, relay
+from gcode_hook import measure as measure_gcode_hook
+
+GCODE_LINES = 100000
+MESSAGES = 20000
+
+
+def bench_gcode_hook(relays, repeat):
+	results = {}
+	for case, gcode, power_off_when_idle in (("inactive", False, False), ("gcode", True, False), ("gcode_auto_off", True, True)):
+		plugin, _ = make_plugin([relay(i, gcode=gcode) for i in range(relays)], startup=False,
+								powerOffWhenIdle=power_off_when_idle, idleIgnoreCommands="M105,M155")
+		results[case] = round(measure_gcode_hook(plugin.processGCODE, GCODE_LINES, repeat))
+	return dict(unit="lines/s", **results)
+
+
+def bench_stat_messages(relays, repeat):
+	plugin, mqtt = make_plugin(relays)
+	targets = [(plugin.generate_mqtt_full_topic(r, "stat"), r) for r in plugin._relays]
+	stream = []
+	for index in range(MESSAGES):
+		topic, _ = targets[index % len(targets)]
+		# every relay flips on each pass, so every message is a state change
+		stream.append((topic, b"ON" if (index // len(targets)) % 2 == 0 else b"OFF"))
+
+	def run():
+		for topic, payload in stream:
+			plugin._on_mqtt_subscription(topic, payload)
+
+	saves_before = plugin._settings.saves
+	best = min(timeit.repeat(run, number=1, repeat=repeat))
+	return dict(unit="messages/s", rate=round(MESSAGES / best), settings_saves=plugin._settings.saves - saves_before)
+
+
+def bench_check_status(relays, repeat):
+	results = dict(unit="publishes")
+	for mode in ("relay", "device"):
+		plugin, mqtt = make_plugin(relays, polling_mode=mode)
+
+		published = mqtt.published
+		start = timeit.default_timer()
+		plugin.on_api_command("checkStatus", {})
+		cold_seconds = timeit.default_timer() - start
+		cold = mqtt.published - published
+
+		# every relay answers, the next page load is served from the cache
+		for r in plugin._relays:
+			plugin._on_mqtt_subscription(plugin.generate_mqtt_full_topic(r, "stat"), b"ON")
+		published = mqtt.published
+		warm_seconds = min(timeit.repeat(lambda: plugin.on_api_command("checkStatus", {}), number=1, repeat=repeat))
+		warm = (mqtt.published - published) // repeat
+
+		results[mode] = dict(cold=cold, warm=warm, cold_seconds=cold_seconds, warm_seconds=warm_seconds)
+	return results
+
+
+def bench_settings(relays, repeat):
+	plugin, mqtt = make_plugin(relays)
+	data = dict(arrRelays=plugin._settings.get(["arrRelays"]))
+	save_seconds = min(timeit.repeat(lambda: plugin.on_settings_save(data), number=1, repeat=repeat))
+
+	# a short session: state reports, status checks, relay switching and a settings save
+	saves_before = plugin._settings.saves
+	for r in plugin._relays:
+		plugin._on_mqtt_subscription(plugin.generate_mqtt_full_topic(r, "stat"), b"ON")
+	plugin.on_api_command("checkStatus", {})
+	for r in plugin._relays:
+		plugin.on_api_command("turnOff", dict(topic=r.topic, relayN=r.relayN))
+		plugin._on_mqtt_subscription(plugin.generate_mqtt_full_topic(r, "stat"), b"OFF")
+	plugin.on_settings_save(data)
+	return dict(unit="seconds", save_seconds=save_seconds, session_settings_saves=plugin._settings.saves - saves_before,
+				subscriptions=len(mqtt.subscriptions))
+
+
+BENCHMARKS = [
+	("gcode_hook", bench_gcode_hook),
+	("stat_messages", bench_stat_messages),
+	("check_status", bench_check_status),
+	("settings", bench_settings),
+]
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument("--relays", default="1,10,100,500", help="comma separated relay counts")
+	parser.add_argument("--repeat", type=int, default=3)
+	parser.add_argument("--only", help="comma separated benchmark names")
+	parser.add_argument("--output", help="write the report to this file instead of stdout")
+	args = parser.parse_args()
+
+	counts = [int(count) for count in args.relays.split(",")]
+	only = set(args.only.split(",")) if args.only else None
+
+	results = []
+	for name, benchmark in BENCHMARKS:
+		if only is not None and name not in only:
+			continue
+		for count in counts:
+			print("{} with {} relays".format(name, count), file=sys.stderr)
+			results.append(dict(benchmark=name, relays=count, result=benchmark(count, args.repeat)))
+
+	report = dict(python=platform.python_version(), platform=platform.platform(), created=time.time(),
+				  repeat=args.repeat, results=results)
+	output = json.dumps(report, indent=2)
+	if args.output:
+		with open(args.output, "w") as f:
+			f.write(output + "\n")
+	else:
+		print(output)
+
+
+if __name__ == "__main__":
+	main()
@@ -4,74 +4,43 @@ from __future__ import absolute_import
 import octoprint.plugin
 from octoprint.server import user_permission
 from octoprint.events import eventManager, Events
-from octoprint.util import RepeatedTimer
+from octoprint.util import monotonic_time
 from octoprint.access.permissions import Permissions, ADMIN_GROUP
 from uptime import uptime
 from flask_babel import gettext
-import threading
-import time
 import os
-import re
 import logging
 import json
-
-try:
-	from octoprint.util import ResettableTimer
-except:
-	class ResettableTimer(threading.Thread):
-		def __init__(self, interval, function, args=None, kwargs=None, on_reset=None, on_cancelled=None):
-			threading.Thread.__init__(self)
-			self._event = threading.Event()
-			self._mutex = threading.Lock()
-			self.is_reset = True
-
-			if args is None:
-				args = []
-			if kwargs is None:
-				kwargs = dict()
-
-			self.interval = interval
-			self.function = function
-			self.args = args
-			self.kwargs = kwargs
-			self.on_cancelled = on_cancelled
-			self.on_reset = on_reset
-
-
-		def run(self):
-			while self.is_reset:
-				with self._mutex:
-					self.is_reset = False
-				self._event.wait(self.interval)
-
-			if not self._event.isSet():
-				self.function(*self.args, **self.kwargs)
-			with self._mutex:
-				self._event.set()
-
-		def cancel(self):
-			with self._mutex:
-				self._event.set()
-
-			if callable(self.on_cancelled):
-				self.on_cancelled()
-
-		def reset(self, interval=None):
-			with self._mutex:
-				if interval:
-					self.interval = interval
-
-				self.is_reset = True
-				self._event.set()
-				self._event.clear()
-
-			if callable(self.on_reset):
-				self.on_reset()
+import threading
+import time
+from collections import OrderedDict
+
+from .acks import CommandTracker
+from .availability import DeviceAvailability
+from .commands import CommandExecutor
+from .cooldown import CooldownMonitor
+from .debuglog import DebugLog
+from .idle import IdleTracker
+from .metrics import HOOK_BUCKETS, MESSAGE_BUCKETS, Metrics
+from .model import RelayState, migrate_relays
+from .polling import StatusPoller
+from .push import PushChannel
+from .registry import RelayRegistry, relay_key
+from .scheduler import Scheduler
+from .sequencer import PowerOnSequencer
+from .state import RelayStateStore
+from .telemetry import EnergyTelemetry, parse_energy
+from .timelapse import TimelapseTracker
+from .topics import TopicMatcher, format_full_topic
+
+# MachineCom.close() waits up to 10s for the send queue, relays waiting for a disconnect are switched off after this
+DISCONNECT_TIMEOUT = 30
 
 class TasmotaMQTTPlugin(octoprint.plugin.SettingsPlugin,
 						octoprint.plugin.AssetPlugin,
 						octoprint.plugin.TemplatePlugin,
 						octoprint.plugin.StartupPlugin,
+						octoprint.plugin.ShutdownPlugin,
 						octoprint.plugin.SimpleApiPlugin,
 						octoprint.plugin.EventHandlerPlugin,
 						octoprint.plugin.WizardPlugin):
@@ -79,23 +48,61 @@ class TasmotaMQTTPlugin(octoprint.plugin.SettingsPlugin,
 	def __init__(self):
 		self._logger = logging.getLogger("octoprint.plugins.tasmota_mqtt")
 		self._tasmota_mqtt_logger = logging.getLogger("octoprint.plugins.tasmota_mqtt.debug")
+		self._debug_log = None
 		self.abortTimeout = 0
-		self._timeout_value = None
 		self._abort_timer = None
 		self._countdown_active = False
-		self._waitForHeaters = False
-		self._waitForTimelapse = False
-		self._timelapse_active = False
+		self._timelapses = TimelapseTracker()
 		self._skipIdleTimer = False
 		self.powerOffWhenIdle = False
-		self._idleTimer = None
+		self._idle_tracker = IdleTracker(30 * 60, self._idle_poweroff)
 		self._autostart_file = None
 		self.mqtt_publish = None
 		self.mqtt_subscribe = None
+		self.mqtt_unsubscribe = None
 		self.idleTimeout = None
 		self.idleIgnoreCommands = None
-		self._idleIgnoreCommandsArray = None
+		self._idleIgnoreCommandsSet = frozenset()
+		self._gcode_hook_active = False
 		self.idleTimeoutWaitTemp = None
+		self.idleTimeoutWaitBedChamber = False
+		self._cooldown = CooldownMonitor(self._on_heaters_cooled, logger=self._tasmota_mqtt_logger)
+		self._relays = RelayRegistry()
+		self._scheduler = Scheduler()
+		self._metrics = Metrics()
+		self._gcode_timing = self._metrics.timing("gcode_hook", "Lines seen by the gcode queuing hook", buckets=HOOK_BUCKETS)
+		self._stat_messages = self._metrics.counter("mqtt_messages_total", "Received relay state messages", kind="stat")
+		self._stat_message_time = self._metrics.histogram("mqtt_message_seconds", "Time spent handling a received message", buckets=MESSAGE_BUCKETS, kind="stat")
+		self._result_messages = self._metrics.counter("mqtt_messages_total", "Received relay state messages", kind="result")
+		self._result_message_time = self._metrics.histogram("mqtt_message_seconds", "Time spent handling a received message", buckets=MESSAGE_BUCKETS, kind="result")
+		self._settings_saves = self._metrics.counter("settings_saves_total", "Settings saves")
+		self._idle_resets = self._metrics.counter("idle_timer_resets_total", "Idle timer resets")
+		self._abort_started = self._metrics.counter("abort_countdowns_total", "Automatic power off countdowns", outcome="started")
+		self._abort_cancelled = self._metrics.counter("abort_countdowns_total", "Automatic power off countdowns", outcome="cancelled")
+		self._metrics.gauge("threads", "Live plugin threads (scheduler, idle tracker, command workers)",
+							lambda: sum(1 for thread in threading.enumerate() if thread.name.startswith("TasmotaMQTT")))
+		self._metrics.gauge("scheduled_actions", "Pending scheduled actions", lambda: len(self._scheduler.pending()))
+		self._metrics.gauge("debug_log_dropped", "Debug log records dropped because the log queue was full",
+							lambda: self._debug_log.dropped if self._debug_log is not None else 0)
+		self._commands = CommandExecutor(logger=self._tasmota_mqtt_logger)
+		self._relay_state = RelayStateStore(self._scheduler)
+		self._push = PushChannel(lambda data: self._plugin_manager.send_plugin_message(self._identifier, data), self._scheduler)
+		self._poller = StatusPoller()
+		self._acks = CommandTracker(self._scheduler, self._resend_power, self._on_command_timeout, metrics=self._metrics)
+		self._availability = DeviceAvailability()
+		self._power_on = PowerOnSequencer(self._schedule_power_on)
+		self._metrics.gauge("offline_devices", "Devices whose last LWT was Offline", lambda: len(self._availability.offline()))
+		# keeps etags from a previous run from matching after a restart
+		self._etag_epoch = "%x" % int(time.time())
+		self._stat_topic_matcher = None
+		self._result_topic_matcher = None
+		self._sensor_topic_matcher = None
+		self._lwt_topic_matcher = None
+		self._energy = EnergyTelemetry()
+		self._last_print_energy = None
+		self.energy_telemetry = False
+		self.subscription_mode = None
+		self.polling_mode = None
 
 	##~~ SettingsPlugin mixin
 
@@ -103,75 +110,46 @@ class TasmotaMQTTPlugin(octoprint.plugin.SettingsPlugin,
 		return dict(
 			arrRelays = [],
 			full_topic_pattern='%topic%/%prefix%/',
+			subscription_mode = 'relay',
+			polling_mode = 'relay',
+			statusCacheTTL = 300,
+			energy_telemetry = False,
 			abortTimeout = 30,
 			powerOffWhenIdle = False,
 			idleTimeout = 30,
 			idleIgnoreCommands = 'M105',
 			idleTimeoutWaitTemp = 50,
+			idleTimeoutWaitBedChamber = False,
+			sysCmdWorkers = 2,
+			sysCmdTimeout = 60,
+			commandAckTimeout = 3,
+			commandRetries = 2,
+			offlineQueueTimeout = 300,
+			powerOnInterval = 2,
+			powerOnConcurrency = 1,
 			debug_logging = False,
+			debug_logging_rate = 5,
 			show_sidebar = True
 		)
 
 	def get_settings_version(self):
-		return 8
+		return 10
 
 	def on_settings_migrate(self, target, current=None):
 		if current is None or current < 3:
 			self._settings.set(['arrRelays'], self.get_settings_defaults()["arrRelays"])
+		else:
+			# relays only ever gained fields, a single pass fills in everything added since the stored version
+			self._settings.set(["arrRelays"], migrate_relays(self._settings.get(["arrRelays"])))
+
+		self._rebuild_relays()
 
-		if current == 2:
-			# Add new fields
-			arrRelays_new = []
-			for relay in self._settings.get(['arrRelays']):
-				relay["automaticShutdownEnabled"] = False
-				arrRelays_new.append(relay)
-			self._settings.set(["arrRelays"],arrRelays_new)
-
-		if current <= 3:
-			# Add new fields
-			arrRelays_new = []
-			for relay in self._settings.get(['arrRelays']):
-				relay["errorEvent"] = False
-				arrRelays_new.append(relay)
-			self._settings.set(["arrRelays"], arrRelays_new)
-
-		if current <= 4:
-			# Add new fields
-			arrRelays_new = []
-			for relay in self._settings.get(['arrRelays']):
-				relay["event_on_upload"] = False
-				relay["event_on_startup"] = False
-				arrRelays_new.append(relay)
-			self._settings.set(["arrRelays"], arrRelays_new)
-
-		if current <= 5:
-			# Add new fields
-			arrRelays_new = []
-			for relay in self._settings.get(['arrRelays']):
-				relay["event_on_connect"] = False
-				relay["event_on_disconnect"] = False
-				relay["disconnectAutoOffDelay"] = 30
-				relay["showInNavbar"] = True
-				arrRelays_new.append(relay)
-			self._settings.set(["arrRelays"], arrRelays_new)
-
-		if current <= 6:
-			# Add new fields
-			arrRelays_new = []
-			for relay in self._settings.get(['arrRelays']):
-				relay["label"] = ""
-				arrRelays_new.append(relay)
-			self._settings.set(["arrRelays"], arrRelays_new)
-
-		if current <= 7:
-			# Add new fields
-			arrRelays_new = []
-			for relay in self._settings.get(['arrRelays']):
-				relay["invertedLogic"] = False
-				arrRelays_new.append(relay)
-			self._settings.set(["arrRelays"], arrRelays_new)
+	def on_settings_initialized(self):
+		self._relay_state.load(os.path.join(self.get_plugin_data_folder(), "relay_state.json"))
+		self._rebuild_relays()
 
 	def on_settings_save(self, data):
+		self._settings_saves.inc()
 		old_debug_logging = self._settings.get_boolean(["debug_logging"])
 		old_powerOffWhenIdle = self._settings.get_boolean(["powerOffWhenIdle"])
 		old_idleTimeout = self._settings.get_int(["idleTimeout"])
@@ -179,24 +157,47 @@ class TasmotaMQTTPlugin(octoprint.plugin.SettingsPlugin,
 		old_idleTimeoutWaitTemp = self._settings.get_int(["idleTimeoutWaitTemp"])
 
 		octoprint.plugin.SettingsPlugin.on_settings_save(self, data)
+		self._rebuild_relays()
+
+		self.subscription_mode = self._settings.get(["subscription_mode"])
+		self.polling_mode = self._settings.get(["polling_mode"])
+		self.energy_telemetry = self._settings.get_boolean(["energy_telemetry"])
+		self._poller.ttl = self._get_int_setting("statusCacheTTL")
+		if self.mqtt_subscribe is not None and self.mqtt_unsubscribe is not None:
+			self._resubscribe_relays()
 
 		self.abortTimeout = self._settings.get_int(["abortTimeout"])
 		self.powerOffWhenIdle = self._settings.get_boolean(["powerOffWhenIdle"])
 
 		self.idleTimeout = self._settings.get_int(["idleTimeout"])
+		self._idle_tracker.set_timeout(self.idleTimeout * 60)
 		self.idleIgnoreCommands = self._settings.get(["idleIgnoreCommands"])
-		self._idleIgnoreCommandsArray = self.idleIgnoreCommands.split(',')
 		self.idleTimeoutWaitTemp = self._settings.get_int(["idleTimeoutWaitTemp"])
+		self.idleTimeoutWaitBedChamber = self._settings.get_boolean(["idleTimeoutWaitBedChamber"])
+		self._compile_gcode_hook()
+
+		self._commands.set_workers(self._get_int_setting("sysCmdWorkers", minimum=1))
+		self._commands.timeout = self._settings.get_int(["sysCmdTimeout"])
+		self._acks.timeout = self._settings.get_float(["commandAckTimeout"])
+		self._acks.retries = self._settings.get_int(["commandRetries"])
+		self._availability.max_age = self._settings.get_int(["offlineQueueTimeout"])
+		self._power_on.interval = self._get_int_setting("powerOnInterval")
+		self._power_on.concurrency = self._get_int_setting("powerOnConcurrency")
 
 		if self.powerOffWhenIdle != old_powerOffWhenIdle:
-			self._plugin_manager.send_plugin_message(self._identifier, dict(powerOffWhenIdle=self.powerOffWhenIdle, type="timeout", timeout_value=self._timeout_value))
+			self._send_timeout_state()
 
 		if self.powerOffWhenIdle:
 			self._tasmota_mqtt_logger.debug("Settings saved, Automatic Power Off Enabled, starting idle timer...")
 			self._reset_idle_timer()
+		else:
+			self._stop_idle_timer()
 
 		new_debug_logging = self._settings.get_boolean(["debug_logging"])
 
+		if self._debug_log is not None:
+			self._debug_log.rate_limit.rate = self._settings.get_float(["debug_logging_rate"])
+
 		if old_debug_logging != new_debug_logging:
 			if new_debug_logging:
 				self._tasmota_mqtt_logger.setLevel(logging.DEBUG)
@@ -212,7 +213,9 @@ class TasmotaMQTTPlugin(octoprint.plugin.SettingsPlugin,
 		tasmota_mqtt_logging_hnadler.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)s: %(message)s"))
 		tasmota_mqtt_logging_hnadler.setLevel(logging.DEBUG)
 
-		self._tasmota_mqtt_logger.addHandler(tasmota_mqtt_logging_hnadler)
+		# the file is written from a listener thread, the serial and mqtt threads only queue the records
+		self._debug_log = DebugLog(self._tasmota_mqtt_logger, tasmota_mqtt_logging_hnadler, rate=self._settings.get_float(["debug_logging_rate"]))
+		self._debug_log.start()
 		self._tasmota_mqtt_logger.setLevel(logging.DEBUG if self._settings.get_boolean(["debug_logging"]) else logging.INFO)
 		self._tasmota_mqtt_logger.propagate = False
 
@@ -221,144 +224,257 @@ class TasmotaMQTTPlugin(octoprint.plugin.SettingsPlugin,
 		if helpers:
 			if "mqtt_subscribe" in helpers:
 				self.mqtt_subscribe = helpers["mqtt_subscribe"]
-				for relay in self._settings.get(["arrRelays"]):
-					self._tasmota_mqtt_logger.debug(self.generate_mqtt_full_topic(relay, "stat"))
-					self.mqtt_subscribe(self.generate_mqtt_full_topic(relay, "stat"), self._on_mqtt_subscription, kwargs=dict(top=relay["topic"],relayN=relay["relayN"]))
+				self.subscription_mode = self._settings.get(["subscription_mode"])
+				self.polling_mode = self._settings.get(["polling_mode"])
+				self.energy_telemetry = self._settings.get_boolean(["energy_telemetry"])
+				self._poller.ttl = self._get_int_setting("statusCacheTTL")
+				self._subscribe_relays()
 			if "mqtt_publish" in helpers:
-				self.mqtt_publish = helpers["mqtt_publish"]
+				self.mqtt_publish = self._counted_publish(helpers["mqtt_publish"])
 				self.mqtt_publish("octoprint/plugin/tasmota", "OctoPrint-TasmotaMQTT publishing.")
-				if any(map(lambda r: r["event_on_startup"] == True, self._settings.get(["arrRelays"]))):
-					for relay in self._settings.get(["arrRelays"]):
-						self._tasmota_mqtt_logger.debug("powering on {} due to startup.".format(relay["topic"]))
-						self.turn_on(relay)
 			if "mqtt_unsubscribe" in helpers:
 				self.mqtt_unsubscribe = helpers["mqtt_unsubscribe"]
 		else:
 			self._plugin_manager.send_plugin_message(self._identifier, dict(noMQTT=True))
 
 		self.abortTimeout = self._settings.get_int(["abortTimeout"])
-		self._tasmota_mqtt_logger.debug("abortTimeout: %s" % self.abortTimeout)
+		self._tasmota_mqtt_logger.debug("abortTimeout: %s", self.abortTimeout)
 
 		self.powerOffWhenIdle = self._settings.get_boolean(["powerOffWhenIdle"])
-		self._tasmota_mqtt_logger.debug("powerOffWhenIdle: %s" % self.powerOffWhenIdle)
+		self._tasmota_mqtt_logger.debug("powerOffWhenIdle: %s", self.powerOffWhenIdle)
 
 		self.idleTimeout = self._settings.get_int(["idleTimeout"])
-		self._tasmota_mqtt_logger.debug("idleTimeout: %s" % self.idleTimeout)
+		self._idle_tracker.set_timeout(self.idleTimeout * 60)
+		self._tasmota_mqtt_logger.debug("idleTimeout: %s", self.idleTimeout)
 		self.idleIgnoreCommands = self._settings.get(["idleIgnoreCommands"])
-		self._idleIgnoreCommandsArray = self.idleIgnoreCommands.split(',')
-		self._tasmota_mqtt_logger.debug("idleIgnoreCommands: %s" % self.idleIgnoreCommands)
+		self._tasmota_mqtt_logger.debug("idleIgnoreCommands: %s", self.idleIgnoreCommands)
 		self.idleTimeoutWaitTemp = self._settings.get_int(["idleTimeoutWaitTemp"])
-		self._tasmota_mqtt_logger.debug("idleTimeoutWaitTemp: %s" % self.idleTimeoutWaitTemp)
+		self._tasmota_mqtt_logger.debug("idleTimeoutWaitTemp: %s", self.idleTimeoutWaitTemp)
+		self.idleTimeoutWaitBedChamber = self._settings.get_boolean(["idleTimeoutWaitBedChamber"])
+		self._tasmota_mqtt_logger.debug("idleTimeoutWaitBedChamber: %s", self.idleTimeoutWaitBedChamber)
+		self._printer.register_callback(self._cooldown)
+
+		self._commands.set_workers(self._get_int_setting("sysCmdWorkers", minimum=1))
+		self._commands.timeout = self._settings.get_int(["sysCmdTimeout"])
+		self._acks.timeout = self._settings.get_float(["commandAckTimeout"])
+		self._acks.retries = self._settings.get_int(["commandRetries"])
+		self._availability.max_age = self._settings.get_int(["offlineQueueTimeout"])
+		self._power_on.interval = self._get_int_setting("powerOnInterval")
+		self._power_on.concurrency = self._get_int_setting("powerOnConcurrency")
+		self._compile_gcode_hook()
+
+		if self.mqtt_publish is not None:
+			self._sequence_power_on([relay for relay in self._relays if relay.event_on_startup == True], "startup")
 
 		if self.powerOffWhenIdle:
 			self._tasmota_mqtt_logger.debug("Starting idle timer due to startup")
 			self._reset_idle_timer()
 
+	##~~ ShutdownPlugin mixin
+
+	def on_shutdown(self):
+		self._relay_state.flush()
+		if self._debug_log is not None:
+			self._debug_log.stop()
+
+	def _counted_publish(self, publish):
+		def mqtt_publish(topic, payload, *args, **kwargs):
+			self._metrics.counter("mqtt_publishes_total", "Published messages", topic=topic).inc()
+			return publish(topic, payload, *args, **kwargs)
+		return mqtt_publish
+
 	def _on_mqtt_subscription(self, topic, message, retained=None, qos=None, *args, **kwargs):
-		self._tasmota_mqtt_logger.debug("Received message for {topic}: {message}".format(**locals()))
-		self.mqtt_publish("octoprint/plugin/tasmota", "echo: " + message.decode("utf-8"))
-		newrelays = []
-		bolRelayStateChanged = False
-		bolForceIdleTimer = False
-		for relay in self._settings.get(["arrRelays"]):
-			if relay["invertedLogic"]:
-				if message.decode("utf-8") == "ON":
-					currentstate = "OFF"
-				elif message.decode("utf-8") == "OFF":
-					currentstate = "ON"
-				else:
-					currentstate = "UNKNOWN"
-			else:
-				currentstate = message.decode("utf-8")
-			if relay["topic"] == "{top}".format(**kwargs) and relay["relayN"] == "{relayN}".format(**kwargs) and relay["currentstate"] != currentstate:
-				bolRelayStateChanged = True
-				relay["currentstate"] = currentstate
-				if relay["automaticShutdownEnabled"] == True and self._settings.get_boolean(["powerOffWhenIdle"]) and relay["currentstate"] == "ON":
-					self._tasmota_mqtt_logger.debug("Forcing reset of idle timer because {} was just turned on.".format(relay["topic"]))
-					bolForceIdleTimer = True
-				self._plugin_manager.send_plugin_message(self._identifier, dict(topic="{top}".format(**kwargs),relayN="{relayN}".format(**kwargs),currentstate=relay["currentstate"]))
-			newrelays.append(relay)
-
-		if bolRelayStateChanged:
-			self._settings.set(["arrRelays"], newrelays)
-			self._settings.save()
-		if bolForceIdleTimer:
+		self._stat_messages.inc()
+		start = monotonic_time()
+		try:
+			self._handle_stat_message(topic, message)
+		finally:
+			self._stat_message_time.observe(monotonic_time() - start)
+
+	def _handle_stat_message(self, topic, message):
+		self._tasmota_mqtt_logger.debug("Received message for %s: %s", topic, message)
+		relay = self._relays.by_stat_topic(topic)
+		if relay is None:
+			parsed = self._stat_topic_matcher.match(topic)
+			if parsed is None:
+				return
+			relay = self._relays.get(*parsed)
+			if relay is None:
+				return
+
+		payload = message.decode("utf-8")
+		self.mqtt_publish("octoprint/plugin/tasmota", "echo: " + payload)
+		self._update_relay_state(relay, payload)
+
+	def _on_mqtt_result(self, topic, message, retained=None, qos=None, *args, **kwargs):
+		self._result_messages.inc()
+		start = monotonic_time()
+		try:
+			self._handle_result_message(topic, message)
+		finally:
+			self._result_message_time.observe(monotonic_time() - start)
+
+	def _handle_result_message(self, topic, message):
+		self._tasmota_mqtt_logger.debug("Received result for %s: %s", topic, message)
+		parsed = self._result_topic_matcher.match(topic)
+		if parsed is None:
+			return
+		relays = self._relays.for_device(parsed[0])
+		if not relays:
+			return
+
+		try:
+			result = json.loads(message.decode("utf-8"))
+		except ValueError:
+			return
+		if not isinstance(result, dict):
+			return
+		# STATUS 11 wraps the same fields in StatusSTS
+		result = result.get("StatusSTS", result)
+
+		for relay in relays:
+			state = result.get("POWER" + relay.relayN)
+			if state is None and relay.relayN in ("", "1"):
+				# single relay devices report POWER no matter how the relay was addressed
+				state = result.get("POWER1" if relay.relayN == "" else "POWER")
+			if state is not None:
+				self._update_relay_state(relay, state)
+
+	def _on_mqtt_sensor(self, topic, message, retained=None, qos=None, *args, **kwargs):
+		parsed = self._sensor_topic_matcher.match(topic)
+		if parsed is None:
+			return
+		relays = self._relays.for_device(parsed[0])
+		if not relays:
+			return
+
+		try:
+			values = parse_energy(json.loads(message.decode("utf-8")))
+		except ValueError:
+			return
+		if values is not None:
+			self._energy.add(relays[0].topic, values)
+
+	def _on_mqtt_lwt(self, topic, message, retained=None, qos=None, *args, **kwargs):
+		parsed = self._lwt_topic_matcher.match(topic)
+		if parsed is None:
+			return
+		relays = self._relays.for_device(parsed[0])
+		if not relays:
+			return
+
+		payload = message.decode("utf-8")
+		device = relays[0].topic
+		self._tasmota_mqtt_logger.debug("%s is %s", device, payload)
+		replay = self._availability.update(device, payload)
+		offline = self._availability.is_offline(device)
+		self._plugin_manager.send_plugin_message(self._identifier, dict(type="availability", topic=device, online=not offline))
+
+		if offline:
+			# nothing will answer, keep what is still unconfirmed for when the device is back. Those commands
+			# already ran their system commands and printer connection, only the publish is repeated
+			for relay, state in self._acks.cancel_device(device):
+				self._availability.queue(relay, state, sent=True)
+		elif replay:
+			self._tasmota_mqtt_logger.debug("%s is back online, sending %s queued commands.", device, len(replay))
+			for state, switch in ((RelayState.ON, self.turn_on_relays), (RelayState.OFF, self.turn_off_relays)):
+				resend = [relay for relay, queued_state, sent in replay if queued_state == state and sent]
+				if resend:
+					self._publish_power(resend, state)
+				relays = [relay for relay, queued_state, sent in replay if queued_state == state and not sent]
+				if relays:
+					switch(relays)
+
+	def _update_relay_state(self, relay, payload):
+		self._poller.seen(relay.topic, relay.relayN)
+		currentstate = relay.state_from_report(payload)
+
+		self._acks.acknowledged(relay, currentstate)
+
+		if relay.currentstate == currentstate:
+			return
+
+		relay.currentstate = currentstate
+		self._relay_state.set(relay.topic, relay.relayN, currentstate)
+		self._push.relay_changed(relay)
+
+		if relay.automaticShutdownEnabled and self.powerOffWhenIdle and currentstate == RelayState.ON:
+			self._tasmota_mqtt_logger.debug("Forcing reset of idle timer because %s was just turned on.", relay.topic)
 			self._reset_idle_timer()
 
 	##~~ EventHandlerPlugin mixin
 
 	def on_event(self, event, payload):
+		# Energy used per print
+		if self.energy_telemetry:
+			if event == Events.PRINT_STARTED:
+				self._energy.print_started()
+			elif event in (Events.PRINT_DONE, Events.PRINT_FAILED, Events.PRINT_CANCELLED):
+				self._record_print_energy(event, payload)
+
 		if event == "WHERE":
 			try:
-				self.mqtt_unsubscribe(self._on_mqtt_subscription)
-				for relay in self._settings.get(["arrRelays"]):
-					self.mqtt_subscribe(self.generate_mqtt_full_topic(relay, "stat"), self._on_mqtt_subscription, kwargs=dict(top=relay["topic"],relayN=relay["relayN"]))
+				self._resubscribe_relays()
 			except:
 				self._plugin_manager.send_plugin_message(self._identifier, dict(noMQTT=True))
 
 		# Client Opened Event
 		elif event == Events.CLIENT_OPENED:
-			self._plugin_manager.send_plugin_message(self._identifier, dict(powerOffWhenIdle=self.powerOffWhenIdle, type="timeout", timeout_value=self._timeout_value))
+			self._send_timeout_state()
+			self._push.snapshot(self._relays)
 			return
 
 		# Print Started Event
 		elif event == Events.PRINT_STARTED and self.powerOffWhenIdle == True:
-			if self._abort_timer is not None:
-				self._abort_timer.cancel()
-				self._abort_timer = None
+			if self._cancel_abort_timer():
 				self._tasmota_mqtt_logger.debug("Power off aborted because starting new print.")
-			if self._idleTimer is not None:
-				self._reset_idle_timer()
-			self._timeout_value = None
-			self._plugin_manager.send_plugin_message(self._identifier, dict(powerOffWhenIdle=self.powerOffWhenIdle, type="timeout", timeout_value=self._timeout_value))
+			self._reset_idle_timer()
+			self._send_timeout_state()
 
 		# Print Error Event
 		elif event == Events.ERROR:
 			self._tasmota_mqtt_logger.debug("Powering off enabled plugs because there was an error.")
-			for relay in self._settings.get(['arrRelays']):
-				if relay.get("errorEvent", False):
-					self.turn_off(relay)
+			self.turn_off_relays([relay for relay in self._relays if relay.errorEvent])
 
 		# Timeplapse Events
-		elif self.powerOffWhenIdle == True and event == Events.MOVIE_RENDERING:
-			self._tasmota_mqtt_logger.debug("Timelapse generation started: %s" % payload.get("movie_basename", ""))
-			self._timelapse_active = True
+		elif event == Events.MOVIE_RENDERING:
+			self._tasmota_mqtt_logger.debug("Timelapse generation started: %s", payload.get("movie_basename", ""))
+			self._timelapses.started(payload.get("movie", payload.get("movie_basename", "")))
 
-		elif self._timelapse_active and event == Events.MOVIE_DONE or event == Events.MOVIE_FAILED:
-			self._tasmota_mqtt_logger.debug("Timelapse generation finished: %s. Return Code: %s" % (payload.get("movie_basename", ""), payload.get("returncode", "completed")))
-			self._timelapse_active = False
+		elif event == Events.MOVIE_DONE or event == Events.MOVIE_FAILED:
+			self._tasmota_mqtt_logger.debug("Timelapse generation finished: %s. Return Code: %s", payload.get("movie_basename", ""), payload.get("returncode", "completed"))
+			self._timelapses.finished(payload.get("movie", payload.get("movie_basename", "")))
 
 		# Printer Connected Event
 		elif event == Events.CONNECTED:
 			if self._autostart_file:
-				self._tasmota_mqtt_logger.debug("printer connected starting print of %s" % self._autostart_file)
+				self._tasmota_mqtt_logger.debug("printer connected starting print of %s", self._autostart_file)
 				self._printer.select_file(self._autostart_file, False, printAfterSelect=True)
 				self._autostart_file = None
 
 		# Printer Connecting event
 		elif event == Events.CONNECTING:
-			for relay in self._settings.get(["arrRelays"]):
-				if relay["event_on_connect"] is True and not self._printer.is_ready():
-					self._tasmota_mqtt_logger.debug("powering on {} due to connection attempt.".format(relay["topic"]))
-					self.turn_on(relay)
+			if not self._printer.is_ready():
+				self._sequence_power_on([relay for relay in self._relays if relay.event_on_connect is True], "connection attempt")
 		# Printer Disconnected event
 		elif event == Events.DISCONNECTED:
-			for relay in self._settings.get(["arrRelays"]):
+			for relay in self._relays:
 				# ToDo: add condition to Settings...
-				if relay["currentstate"] == "ON" and relay["event_on_disconnect"] is True:
-					self._tasmota_mqtt_logger.debug("powering off {} after {} due to disconnect event.".format(relay["topic"],int(relay["disconnectAutoOffDelay"])))
-					t = threading.Timer(int(relay["disconnectAutoOffDelay"]),self.turn_off,[relay])
-					t.start()
+				if relay.currentstate == RelayState.ON and relay.event_on_disconnect is True:
+					if self._acks.is_pending(relay, RelayState.OFF):
+						# switched off by the sequence that disconnected the printer, just waiting for the reply
+						continue
+					# own key, a power off sequence that is disconnecting the printer keeps its "power" action
+					self._tasmota_mqtt_logger.debug("powering off %s after %s due to disconnect event.", relay.topic, relay.disconnectAutoOffDelay)
+					self._schedule_relay_action("disconnectOff", relay, relay.disconnectAutoOffDelay, self.turn_off, [relay])
 		# File Uploaded Event
-		elif event == Events.UPLOAD and any(map(lambda r: r["event_on_upload"] == True, self._settings.get(["arrRelays"]))):
+		elif event == Events.UPLOAD and any(map(lambda r: r.event_on_upload == True, self._relays)):
 			if payload.get("print", False):  # implemented in OctoPrint version 1.4.1
-				self._tasmota_mqtt_logger.debug(
-					"File uploaded: %s. Turning enabled relays on." % payload.get("name", ""))
-				self._tasmota_mqtt_logger.debug(payload)
-				for relay in self._settings.get(['arrRelays']):
-					self._tasmota_mqtt_logger.debug(relay)
-					if relay["event_on_upload"] is True and not self._printer.is_ready():
-						self._tasmota_mqtt_logger.debug("powering on %s due to %s event." % (relay["topic"], event))
+				self._tasmota_mqtt_logger.debug("File uploaded: %s. Turning enabled relays on.", payload.get("name", ""))
+				self._tasmota_mqtt_logger.debug("%s", payload)
+				for relay in self._relays:
+					if relay.event_on_upload is True and not self._printer.is_ready():
+						self._tasmota_mqtt_logger.debug("powering on %s due to %s event.", relay.topic, event)
 						if payload.get("path", False) and payload.get("target") == "local":
 							self._autostart_file = payload.get("path")
 							self.turn_on(relay)
@@ -366,9 +482,11 @@ class TasmotaMQTTPlugin(octoprint.plugin.SettingsPlugin,
 	##~~ AssetPlugin mixin
 
 	def get_assets(self):
+		# the settings only libraries (jquery-ui, knockout-sortable, the icon picker) are loaded by tasmota_mqtt.js
+		# when the settings are opened, icons come from OctoPrint's own Font Awesome
 		return dict(
-			js=["js/jquery-ui.min.js","js/knockout-sortable.1.2.0.js","js/fontawesome-iconpicker.js","js/ko.iconpicker.js","js/tasmota_mqtt.js"],
-			css=["css/font-awesome.min.css","css/font-awesome-v4-shims.min.css","css/fontawesome-iconpicker.css","css/tasmota_mqtt.css"]
+			js=["js/tasmota_mqtt.js"],
+			css=["css/tasmota_mqtt.css"]
 		)
 
 	##~~ TemplatePlugin mixin
@@ -393,6 +511,14 @@ class TasmotaMQTTPlugin(octoprint.plugin.SettingsPlugin,
 			enableAutomaticShutdown=[],
 			disableAutomaticShutdown=[],
 			abortAutomaticShutdown=[],
+			getIdleStatus=[],
+			getScheduledActions=[],
+			getCommandRuns=[],
+			getCommandLatency=[],
+			getAvailability=[],
+			getEnergyHistory=[],
+			groupOn=["group"],
+			groupOff=["group"],
 			getListPlug=[])
 
 	def on_api_command(self, command, data):
@@ -400,35 +526,54 @@ class TasmotaMQTTPlugin(octoprint.plugin.SettingsPlugin,
 			from flask import make_response
 			return make_response("Insufficient rights", 403)
 
+		relay = None
+		if "topic" in data and "relayN" in data:
+			relay = self._relays.get(data["topic"], data["relayN"])
+
 		if command == 'toggleRelay' or command == 'turnOn' or command == 'turnOff':
-			for relay in self._settings.get(["arrRelays"]):
-				if relay["topic"] == "{topic}".format(**data) and relay["relayN"] == "{relayN}".format(**data):
-					if command == "turnOff" or (command == "toggleRelay" and relay["currentstate"] == "ON"):
-						self._tasmota_mqtt_logger.debug("turning off {topic} relay {relayN}".format(**data))
-						self.turn_off(relay)
-					if command == "turnOn" or (command == "toggleRelay" and relay["currentstate"] == "OFF"):
-						self._tasmota_mqtt_logger.debug("turning on {topic} relay {relayN}".format(**data))
-						self.turn_on(relay)
+			if relay is not None and self._availability.is_offline(relay.topic):
+				# fail right away instead of leaving the caller waiting for a reply that can't come
+				state = RelayState.OFF if command == "turnOff" or (command == "toggleRelay" and relay.currentstate == RelayState.ON) else RelayState.ON
+				self._on_device_offline(relay, state)
+				from flask import make_response
+				return make_response(json.dumps(dict(status="offline", topic=relay.topic, relayN=relay.relayN)), 409)
+			if relay is not None:
+				if command == "turnOff" or (command == "toggleRelay" and relay.currentstate == RelayState.ON):
+					self._tasmota_mqtt_logger.debug("turning off %s relay %s", data["topic"], data["relayN"])
+					self.turn_off(relay)
+				if command == "turnOn" or (command == "toggleRelay" and relay.currentstate == RelayState.OFF):
+					self._tasmota_mqtt_logger.debug("turning on %s relay %s", data["topic"], data["relayN"])
+					self.turn_on(relay)
+		if command == 'groupOn' or command == 'groupOff':
+			relays = self._relays.for_group(data["group"])
+			self._tasmota_mqtt_logger.debug("turning %s group %s with %s relays", "on" if command == "groupOn" else "off", data["group"], len(relays))
+			if command == "groupOn":
+				self.turn_on_relays(relays)
+			else:
+				self.turn_off_relays(relays)
+			return json.dumps(dict(relays=["{}|{}".format(relay.topic, relay.relayN) for relay in relays]))
+
 		if command == 'checkStatus':
-			for relay in self._settings.get(["arrRelays"]):
-				self._tasmota_mqtt_logger.debug("checking status of %s relay %s" % (relay["topic"],relay["relayN"]))
-				try:
-					self.mqtt_publish(self.generate_mqtt_full_topic(relay, "cmnd"),"")
-				except:
-					self._plugin_manager.send_plugin_message(self._identifier, dict(noMQTT=True))
+			polled = []
+			try:
+				polled = self._check_status()
+			except:
+				self._plugin_manager.send_plugin_message(self._identifier, dict(noMQTT=True))
+			# answer from the cache right away, polled relays report back through the plugin messages
+			return json.dumps(dict(relays=[dict(topic=relay.topic, relayN=relay.relayN, currentstate=relay.currentstate) for relay in self._relays],
+								   polled=polled, offline=self._availability.offline()))
 
 		if command == 'checkRelay':
-			self._tasmota_mqtt_logger.debug("subscribing to {topic} relay {relayN}".format(**data))
-			for relay in self._settings.get(["arrRelays"]):
-				if relay["topic"] == "{topic}".format(**data) and relay["relayN"] == "{relayN}".format(**data):
-					self.mqtt_subscribe(self.generate_mqtt_full_topic(relay, "stat"), self._on_mqtt_subscription, kwargs=dict(top="{topic}".format(**data),relayN="{relayN}".format(**data)))
-					self._tasmota_mqtt_logger.debug("checking {topic} relay {relayN}".format(**data))
-					self.mqtt_publish(self.generate_mqtt_full_topic(relay, "cmnd"), "")
+			self._tasmota_mqtt_logger.debug("subscribing to %s relay %s", data["topic"], data["relayN"])
+			if relay is not None:
+				if self.subscription_mode != "wildcard":
+					self.mqtt_subscribe(self.generate_mqtt_full_topic(relay, "stat"), self._on_mqtt_subscription, kwargs=dict(top=relay.topic,relayN=relay.relayN))
+				self._tasmota_mqtt_logger.debug("checking %s relay %s", data["topic"], data["relayN"])
+				self.mqtt_publish(self.generate_mqtt_full_topic(relay, "cmnd"), "")
 
 		if command == 'removeRelay':
-			for relay in self._settings.get(["arrRelays"]):
-				if relay["topic"] == "{topic}".format(**data) and relay["relayN"] == "{relayN}".format(**data):
-					self.mqtt_unsubscribe(self._on_mqtt_subscription,topic=self.generate_mqtt_full_topic(relay, "stat"))
+			if relay is not None and self.subscription_mode != "wildcard":
+				self.mqtt_unsubscribe(self._on_mqtt_subscription,topic=self.generate_mqtt_full_topic(relay, "stat"))
 
 		if command == 'enableAutomaticShutdown':
 			self.powerOffWhenIdle = True
@@ -437,142 +582,348 @@ class TasmotaMQTTPlugin(octoprint.plugin.SettingsPlugin,
 
 		if command == 'disableAutomaticShutdown':
 			self.powerOffWhenIdle = False
-			if self._abort_timer is not None:
-				self._abort_timer.cancel()
-				self._abort_timer = None
-			self._timeout_value = None
+			self._cancel_abort_timer()
 			self._tasmota_mqtt_logger.debug("Automatic Power Off disabled, stopping idle and abort timers.")
 			self._stop_idle_timer()
 
 		if command == 'abortAutomaticShutdown':
-			if self._abort_timer is not None:
-				self._abort_timer.cancel()
-				self._abort_timer = None
-			self._timeout_value = None
+			self._cancel_abort_timer()
 			self._tasmota_mqtt_logger.debug("Power off aborted.")
 			self._tasmota_mqtt_logger.debug("Restarting idle timer.")
 			self._reset_idle_timer()
 
 		if command == "enableAutomaticShutdown" or command == "disableAutomaticShutdown":
-			self._tasmota_mqtt_logger.debug("Automatic power off setting changed: %s" % self.powerOffWhenIdle)
+			self._tasmota_mqtt_logger.debug("Automatic power off setting changed: %s", self.powerOffWhenIdle)
+			self._compile_gcode_hook()
 			self._settings.set_boolean(["powerOffWhenIdle"], self.powerOffWhenIdle)
 			self._settings.save()
+			self._settings_saves.inc()
 
 		if command == "enableAutomaticShutdown" or command == "disableAutomaticShutdown" or command == "abortAutomaticShutdown":
-			self._plugin_manager.send_plugin_message(self._identifier, dict(powerOffWhenIdle=self.powerOffWhenIdle, type="timeout", timeout_value=self._timeout_value))
+			self._send_timeout_state()
+
+		if command == "getIdleStatus":
+			return json.dumps(dict(powerOffWhenIdle=self.powerOffWhenIdle, idle_age=self._idle_tracker.idle_age, idle_remaining=self._idle_tracker.remaining))
+
+		if command == "getScheduledActions":
+			return json.dumps(self._scheduler.pending())
+
+		if command == "getCommandRuns":
+			return json.dumps(self._commands.runs())
+
+		if command == "getEnergyHistory":
+			# optional: topic, resolution (raw, minute or 10min) and since (unix time)
+			resolution = data.get("resolution", "raw")
+			if resolution not in self._energy.resolutions:
+				from flask import make_response
+				return make_response("Unknown resolution", 400)
+			since = data.get("since")
+			if since is not None:
+				try:
+					since = float(since)
+				except (TypeError, ValueError):
+					from flask import make_response
+					return make_response("Invalid since", 400)
+			return json.dumps(dict(fields=["time", "power", "voltage", "current", "total"],
+								   resolution=resolution,
+								   devices=self._energy.history(resolution, topic=data.get("topic"), since=since),
+								   latest=self._energy.latest(),
+								   last_print=self._last_print_energy))
+
+		if command == "getAvailability":
+			return json.dumps(dict(offline=self._availability.offline(), queued=self._availability.queued()))
+
+		if command == "getCommandLatency":
+			return json.dumps(dict(devices=self._acks.latency(), pending=self._acks.pending()))
 
 		if command == "getListPlug":
-			return json.dumps(self._settings.get(["arrRelays"]))
+			return json.dumps(self._relays.as_list())
+
+	def on_api_get(self, request):
+		# compact relay states for dashboards and scripts, GET /api/plugin/tasmota_mqtt[?topic=...], or the
+		# plugin's metrics with ?metrics
+		from flask import make_response
+		if not Permissions.PLUGIN_TASMOTA_MQTT_CONTROL.can():
+			return make_response("Insufficient rights", 403)
+
+		if "metrics" in request.args:
+			# ?metrics for json, ?metrics=prometheus for the prometheus text format
+			if request.args.get("metrics") == "prometheus":
+				response = make_response(self._metrics.prometheus())
+				response.mimetype = "text/plain; version=0.0.4"
+				return response
+			response = make_response(json.dumps(self._metrics.as_dict()))
+			response.mimetype = "application/json"
+			return response
+
+		topics = set(topic.upper() for topic in request.args.getlist("topic"))
+		etag = "{}-{}-{}-{}".format(self._etag_epoch, self._relays.generation, self._relay_state.version, ",".join(sorted(topics)))
+		if etag in request.if_none_match:
+			response = make_response("", 304)
+			response.set_etag(etag)
+			return response
+
+		relays = []
+		for relay in self._relays:
+			if topics and relay.topic.upper() not in topics:
+				continue
+			relays.append(dict(topic=relay.topic, relayN=relay.relayN, state=relay.currentstate,
+							   changed=self._relay_state.changed(relay.topic, relay.relayN)))
+
+		response = make_response(json.dumps(dict(relays=relays)))
+		response.mimetype = "application/json"
+		response.set_etag(etag)
+		return response
 
 	def turn_on(self, relay):
-		if relay["invertedLogic"]:
-			self.mqtt_publish(self.generate_mqtt_full_topic(relay, "cmnd"), "OFF")
-		else:
-			self.mqtt_publish(self.generate_mqtt_full_topic(relay, "cmnd"), "ON")
-		if relay["sysCmdOn"]:
-			t = threading.Timer(int(relay["sysCmdOnDelay"]),os.system,args=[relay["sysCmdRunOn"]])
-			t.start()
-		if relay["connect"] and self._printer.is_closed_or_error():
-			t = threading.Timer(int(relay["connectOnDelay"]),self._printer.connect)
-			t.start()
-		if self.powerOffWhenIdle == True and relay["automaticShutdownEnabled"] == True:
-			self._tasmota_mqtt_logger.debug("Resetting idle timer since relay %s | %s was just turned on." % (relay["topic"], relay["relayN"]))
-			self._waitForHeaters = False
-			self._reset_idle_timer()
+		self.turn_on_relays([relay])
+
+	def turn_on_relays(self, relays):
+		relays = self._online_relays(relays, RelayState.ON)
+		for relay in relays:
+			self._cancel_relay_actions(relay, "power", "disconnectOff", "sysCmdOff")
+		self._publish_power(relays, RelayState.ON)
+		for relay in relays:
+			if relay.sysCmdOn:
+				self._schedule_relay_action("sysCmdOn", relay, relay.sysCmdOnDelay, self._run_system_command, [relay.sysCmdRunOn, relay])
+			if relay.connect and self._printer.is_closed_or_error():
+				self._schedule_relay_action("connect", relay, relay.connectOnDelay, self._printer.connect)
+			if self.powerOffWhenIdle == True and relay.automaticShutdownEnabled == True:
+				self._tasmota_mqtt_logger.debug("Resetting idle timer since relay %s | %s was just turned on.", relay.topic, relay.relayN)
+				self._cancel_pending_poweroff()
+				self._reset_idle_timer()
 
 	def turn_off(self, relay):
-		if relay["sysCmdOff"]:
-			t = threading.Timer(int(relay["sysCmdOffDelay"]),os.system,args=[relay["sysCmdRunOff"]])
-			t.start()
-		if relay["disconnect"]:
-			self._printer.disconnect()
-			time.sleep(int(relay["disconnectOffDelay"]))
-		if relay["invertedLogic"]:
-			self.mqtt_publish(self.generate_mqtt_full_topic(relay, "cmnd"), "ON")
-		else:
-			self.mqtt_publish(self.generate_mqtt_full_topic(relay, "cmnd"), "OFF")
+		self.turn_off_relays([relay])
+
+	def turn_off_relays(self, relays):
+		# returns right away, the printer is disconnected on a worker thread and the disconnect delay is
+		# waited out on the scheduler
+		immediate = []
+		disconnecting = []
+		for relay in self._online_relays(relays, RelayState.OFF):
+			self._cancel_relay_actions(relay, "power", "disconnectOff", "sysCmdOn", "connect")
+			if relay.disconnect:
+				disconnecting.append(relay)
+			else:
+				immediate.append(relay)
+		if disconnecting:
+			self._disconnect_then_off(disconnecting)
+		if immediate:
+			self._publish_off(immediate)
+
+	def _disconnect_then_off(self, relays):
+		# the relays' power actions hold their slot while the printer disconnects, so turning one back on in
+		# the meantime still cancels it. Should the disconnect hang they switch off after the timeout anyway
+		waiting = []
+		for relay in relays:
+			self._send_sequence_progress(relay, "disconnecting")
+			waiting.append((relay, self._schedule_relay_action("power", relay, DISCONNECT_TIMEOUT + relay.disconnectOffDelay,
+															   self._publish_off, [[relay]])))
+
+		def disconnect():
+			try:
+				self._printer.disconnect()
+			except Exception:
+				self._logger.exception("Error while disconnecting the printer")
+			for relay, action in waiting:
+				if action.cancelled or action.when <= monotonic_time():
+					continue
+				self._send_sequence_progress(relay, "disconnected", delay=relay.disconnectOffDelay)
+				self._schedule_relay_action("power", relay, relay.disconnectOffDelay, self._publish_off, [[relay]])
+
+		thread = threading.Thread(target=disconnect, name="TasmotaMQTT printer disconnect")
+		thread.daemon = True
+		thread.start()
+
+	def _publish_off(self, relays):
+		self._publish_power(relays, RelayState.OFF)
+		for relay in relays:
+			self._cancel_relay_actions(relay, "disconnectOff")
+			if relay.sysCmdOff:
+				self._schedule_relay_action("sysCmdOff", relay, relay.sysCmdOffDelay, self._run_system_command, [relay.sysCmdRunOff, relay])
+			if relay.disconnect:
+				self._send_sequence_progress(relay, "done")
+
+	def _online_relays(self, relays, state):
+		# commands for devices that reported Offline are queued as a whole, their system commands and printer
+		# (dis)connection run when the command is replayed
+		online = []
+		for relay in relays:
+			if self._availability.is_offline(relay.topic):
+				self._on_device_offline(relay, state)
+			else:
+				online.append(relay)
+		return online
+
+	def _publish_power(self, relays, state):
+		# one message per device, several relays of the same device go out as a single Backlog. Devices
+		# that went Offline since the command was started get nothing, it is queued for when they are back
+		devices = OrderedDict()
+		for relay in relays:
+			if self._availability.is_offline(relay.topic):
+				self._on_device_offline(relay, state)
+				continue
+			devices.setdefault(relay.topic.upper(), []).append(relay)
+
+		for device_relays in devices.values():
+			if len(device_relays) == 1:
+				relay = device_relays[0]
+				self.mqtt_publish(self.generate_mqtt_full_topic(relay, "cmnd"), relay.power_payload(state))
+			else:
+				backlog = "; ".join("POWER{} {}".format(relay.relayN, relay.power_payload(state)) for relay in device_relays)
+				self.mqtt_publish(self._relays.device_topic(device_relays[0].topic, "cmnd", "Backlog"), backlog)
+			for relay in device_relays:
+				self._acks.sent(relay, state)
+
+	def _resend_power(self, relay, state):
+		self._tasmota_mqtt_logger.debug("No reply from %s|%s, sending %s again.", relay.topic, relay.relayN, state)
+		self.mqtt_publish(self.generate_mqtt_full_topic(relay, "cmnd"), relay.power_payload(state))
+
+	def _on_command_timeout(self, relay, state):
+		self._tasmota_mqtt_logger.warning("%s|%s did not confirm %s after %s retries.", relay.topic, relay.relayN, state, self._acks.retries)
+		self._plugin_manager.send_plugin_message(self._identifier, dict(type="command_timeout", topic=relay.topic, relayN=relay.relayN, state=state))
+
+	def _on_device_offline(self, relay, state):
+		queued = self._availability.queue(relay, state)
+		self._tasmota_mqtt_logger.warning("Not switching %s|%s %s, the device is offline%s.", relay.topic, relay.relayN, state,
+										  " (queued until it is back)" if queued else "")
+		self._plugin_manager.send_plugin_message(self._identifier, dict(type="command_offline", topic=relay.topic, relayN=relay.relayN, state=state, queued=queued))
+
+	def _send_sequence_progress(self, relay, step, **kwargs):
+		self._plugin_manager.send_plugin_message(self._identifier, dict(type="sequence", topic=relay.topic, relayN=relay.relayN, step=step, **kwargs))
 
 	##~~ at command processing hook
 
 	def processAtCommand(self, comm_instance, phase, command, parameters, tags=None, *args, **kwargs):
 		if command == "TASMOTAMQTT":
 			parameters = parameters.split(' ')
-			self._tasmota_mqtt_logger.debug("@ command received parameters: {}".format(parameters))
+			self._tasmota_mqtt_logger.debug("@ command received parameters: %s", parameters)
 			if len(parameters) >= 3:
-				for relay in self._settings.get(["arrRelays"]):
-					if relay["topic"].upper() == parameters[0].upper() and parameters[1] in [relay["relayN"], "0"]:
-						if parameters[2] == "ON":
-							self.turn_on(relay)
-						if parameters[2] == "OFF":
-							self.turn_off(relay)
+				if parameters[0].upper() == "GROUP":
+					relays = self._relays.for_group(parameters[1])
+				elif parameters[1] == "0":
+					relays = self._relays.for_device(parameters[0])
+				else:
+					relay = self._relays.get(parameters[0], parameters[1])
+					relays = [relay] if relay is not None else []
+				if parameters[2] == RelayState.ON:
+					self.turn_on_relays(relays)
+				if parameters[2] == RelayState.OFF:
+					self.turn_off_relays(relays)
 
 	##~~ Gcode processing hook
 
 	def gcode_turn_off(self, relay):
-		if relay["warnPrinting"] and self._printer.is_printing():
-			self._tasmota_mqtt_logger.debug("Not powering off %s | %s because printer is printing." % (relay["topic"],relay["relayN"]))
-		else:
-			self.turn_off(relay)
+		self.gcode_turn_off_relays([relay])
+
+	def gcode_turn_off_relays(self, relays):
+		printing = self._printer.is_printing()
+		allowed = []
+		for relay in relays:
+			if relay.warnPrinting and printing:
+				self._tasmota_mqtt_logger.debug("Not powering off %s | %s because printer is printing.", relay.topic, relay.relayN)
+			else:
+				allowed.append(relay)
+		if allowed:
+			self.turn_off_relays(allowed)
+
+	def _compile_gcode_hook(self):
+		ignore_commands = self._settings.get(["idleIgnoreCommands"]) or ""
+		self._idleIgnoreCommandsSet = frozenset(c.strip().upper() for c in ignore_commands.split(",") if c.strip())
+		self._gcode_hook_active = self.powerOffWhenIdle or any(relay.gcode for relay in self._relays)
 
 	def processGCODE(self, comm_instance, phase, cmd, cmd_type, gcode, *args, **kwargs):
-		if gcode:
-			if cmd.startswith("M8") and cmd.count(" ") >= 1:
-				topic = cmd.split()[1]
-				if cmd.count(" ") == 2:
-					relayN = cmd.split()[2]
-				else:
-					relayN = ""
-				for relay in self._settings.get(["arrRelays"]):
-					if relay["topic"].upper() == topic.upper() and relay["relayN"] == relayN and relay["gcode"]:
-						if cmd.startswith("M80"):
-							t = threading.Timer(int(relay["gcodeOnDelay"]),self.turn_on,[relay])
-							t.start()
-							return "M80"
-						elif cmd.startswith("M81"):
-							## t = threading.Timer(int(relay["gcodeOffDelay"]),self.mqtt_publish,[relay["topic"] + "/cmnd/Power" + relay["relayN"], "OFF"])
-							t = threading.Timer(int(relay["gcodeOffDelay"]),self.gcode_turn_off,[relay])
-							t.start()
-							return "M81"
-			elif self.powerOffWhenIdle and not (gcode in self._idleIgnoreCommandsArray):
-				self._waitForHeaters = False
-				self._reset_idle_timer()
-				return
-			else:
-				return
+		# runs for every queued line, keep the common case free of allocations. Every line is counted but
+		# only every 64th is timed
+		timing = self._gcode_timing
+		timing.calls += 1
+		if not self._gcode_hook_active or not gcode:
+			return
+		if timing.calls & timing.mask:
+			return self._process_gcode(cmd, gcode)
+		start = monotonic_time()
+		try:
+			return self._process_gcode(cmd, gcode)
+		finally:
+			timing.observe_since(start)
+
+	def _process_gcode(self, cmd, gcode):
+
+		if (gcode == "M80" or gcode == "M81") and " " in cmd:
+			return self._process_power_gcode(cmd, gcode)
+
+		if self.powerOffWhenIdle and gcode not in self._idleIgnoreCommandsSet:
+			if self._cooldown.active or self._timelapses.waiting:
+				self._cancel_pending_poweroff()
+			self._idle_tracker.touch()
+			self._idle_resets.inc()
+
+	def _process_power_gcode(self, cmd, gcode):
+		parameters = cmd.split()
+		if len(parameters) == 3 and parameters[1].upper() == "GROUP" and self._relays.for_group(parameters[2]):
+			return self._process_group_gcode(parameters[2], gcode)
+
+		relayN = parameters[2] if len(parameters) == 3 else ""
+		relay = self._relays.get(parameters[1], relayN)
+		if relay is None or not relay.gcode:
+			return
+
+		if gcode == "M80":
+			self._schedule_relay_action("power", relay, relay.gcodeOnDelay, self.turn_on, [relay])
+			return "M80"
 		else:
+			self._schedule_relay_action("power", relay, relay.gcodeOffDelay, self.gcode_turn_off, [relay])
+			return "M81"
+
+	def _process_group_gcode(self, group, gcode):
+		relays = [relay for relay in self._relays.for_group(group) if relay.gcode]
+		if not relays:
 			return
 
+		# members without a delay are switched together, the others keep their own delayed action
+		delay_field = "gcodeOnDelay" if gcode == "M80" else "gcodeOffDelay"
+		function = self.turn_on if gcode == "M80" else self.gcode_turn_off
+		batch = []
+		for relay in relays:
+			delay = getattr(relay, delay_field)
+			if delay > 0:
+				self._schedule_relay_action("power", relay, delay, function, [relay])
+			else:
+				batch.append(relay)
+		if batch:
+			function = self.turn_on_relays if gcode == "M80" else self.gcode_turn_off_relays
+			self._scheduler.schedule(0, function, args=[batch], key=("power", "GROUP", group.upper()),
+									 description="{} group {}".format(gcode, group))
+		return gcode
+
 	##~~ Idle Timeout
 
 	def _start_idle_timer(self):
-		self._stop_idle_timer()
-
-		if self.powerOffWhenIdle and any(map(lambda r: r["currentstate"] == "ON", self._settings.get(["arrRelays"]))):
-			self._idleTimer = ResettableTimer(self.idleTimeout * 60, self._idle_poweroff)
-			self._idleTimer.start()
+		if self.powerOffWhenIdle:
+			self._idle_tracker.start()
 
 	def _stop_idle_timer(self):
-		if self._idleTimer:
-			self._idleTimer.cancel()
-			self._idleTimer = None
+		self._idle_tracker.stop()
 
 	def _reset_idle_timer(self):
-		try:
-			if self._idleTimer.is_alive():
-				self._idleTimer.reset()
-			else:
-				raise Exception()
-		except:
+		self._idle_resets.inc()
+		if self._idle_tracker.armed:
+			self._idle_tracker.touch()
+		else:
 			self._start_idle_timer()
 
 	def _idle_poweroff(self):
 		if not self.powerOffWhenIdle:
 			return
 
-		if self._waitForHeaters:
+		if not any(relay.currentstate == RelayState.ON for relay in self._relays):
 			return
 
-		if self._waitForTimelapse:
+		if self._cooldown.active:
+			return
+
+		if self._timelapses.waiting:
 			return
 
 		if self._printer.is_printing() or self._printer.is_paused():
@@ -580,39 +931,28 @@ class TasmotaMQTTPlugin(octoprint.plugin.SettingsPlugin,
 
 		if (uptime()/60) <= (self._settings.get_int(["idleTimeout"])):
 			self._tasmota_mqtt_logger.debug("Just booted so wait for time sync.")
-			self._tasmota_mqtt_logger.debug("uptime: {}, comparison: {}".format((uptime()/60), (self._settings.get_int(["idleTimeout"]))))
+			self._tasmota_mqtt_logger.debug("uptime: %s, comparison: %s", uptime() / 60, self.idleTimeout)
 			self._reset_idle_timer()
 			return
 
-		self._tasmota_mqtt_logger.debug("Idle timeout reached after %s minute(s). Turning heaters off prior to powering off plugs." % self.idleTimeout)
-		if self._wait_for_heaters():
-			self._tasmota_mqtt_logger.debug("Heaters below temperature.")
-			if self._wait_for_timelapse():
-				self._timer_start()
-		else:
-			self._tasmota_mqtt_logger.debug("Aborted power off due to activity.")
-
-	##~~ Timelapse Monitoring
+		self._tasmota_mqtt_logger.debug("Idle timeout reached after %s minute(s). Turning heaters off prior to powering off plugs.", self.idleTimeout)
+		self._turn_off_heaters()
+		self._cooldown.start(self.idleTimeoutWaitTemp, self.idleTimeoutWaitBedChamber, self._printer.get_current_temperatures())
 
-	def _wait_for_timelapse(self):
-		self._waitForTimelapse = True
+	def _on_heaters_cooled(self):
+		self._tasmota_mqtt_logger.debug("Heaters below temperature.")
 		self._tasmota_mqtt_logger.debug("Checking timelapse status before shutting off power...")
+		if not self._timelapses.when_idle(self._on_timelapses_finished):
+			self._tasmota_mqtt_logger.debug("Waiting for timelapse before shutting off power...")
 
-		while True:
-			if not self._waitForTimelapse:
-				return False
-
-			if not self._timelapse_active:
-				self._waitForTimelapse = False
-				return True
+	##~~ Timelapse Monitoring
 
-			self._tasmota_mqtt_logger.debug("Waiting for timelapse before shutting off power...")
-			time.sleep(5)
+	def _on_timelapses_finished(self):
+		self._timer_start()
 
 	##~~ Temperature Cooldown
 
-	def _wait_for_heaters(self):
-		self._waitForHeaters = True
+	def _turn_off_heaters(self):
 		heaters = self._printer.get_current_temperatures()
 
 		for heater, entry in heaters.items():
@@ -628,86 +968,197 @@ class TasmotaMQTTPlugin(octoprint.plugin.SettingsPlugin,
 				continue
 
 			if temp != 0:
-				self._tasmota_mqtt_logger.debug("Turning off heater: %s" % heater)
+				self._tasmota_mqtt_logger.debug("Turning off heater: %s", heater)
 				self._skipIdleTimer = True
 				self._printer.set_temperature(heater, 0)
 				self._skipIdleTimer = False
 			else:
-				self._tasmota_mqtt_logger.debug("Heater %s already off." % heater)
+				self._tasmota_mqtt_logger.debug("Heater %s already off.", heater)
 
-		while True:
-			if not self._waitForHeaters:
-				return False
+	def _cancel_pending_poweroff(self):
+		cancelled_cooldown = self._cooldown.cancel()
+		cancelled_timelapse_wait = self._timelapses.cancel()
+		if cancelled_cooldown or cancelled_timelapse_wait:
+			self._tasmota_mqtt_logger.debug("Aborted power off due to activity.")
 
-			heaters = self._printer.get_current_temperatures()
+	##~~ Abort Power Off Timer
 
-			highest_temp = 0
-			heaters_above_waittemp = []
-			for heater, entry in heaters.items():
-				if not heater.startswith("tool"):
-					continue
+	def _timer_start(self):
+		if self._abort_timer is not None:
+			return
 
-				actual = entry.get("actual")
-				if actual is None:
-					# heater doesn't exist in fw
-					continue
+		self._tasmota_mqtt_logger.debug("Starting abort power off timer.")
 
-				try:
-					temp = float(actual)
-				except ValueError:
-					# not a float for some reason, skip it
-					continue
+		# the browser counts down locally from the deadline sent once here
+		self._abort_timer = self._scheduler.schedule(self.abortTimeout, self._timer_expired, key=("abort",), description="automatic power off")
+		self._abort_started.inc()
+		self._send_timeout_state()
 
-				self._tasmota_mqtt_logger.debug("Heater %s = %sC" % (heater,temp))
-				if temp > self.idleTimeoutWaitTemp:
-					heaters_above_waittemp.append(heater)
+	def _cancel_abort_timer(self):
+		if self._abort_timer is None:
+			return False
+		self._abort_timer.cancel()
+		self._abort_timer = None
+		self._abort_cancelled.inc()
+		return True
 
-				if temp > highest_temp:
-					highest_temp = temp
+	def _timer_expired(self):
+		self._abort_timer = None
+		self._send_timeout_state()
+		self._shutdown_system()
 
-			if highest_temp <= self.idleTimeoutWaitTemp:
-				self._waitForHeaters = False
-				return True
+	def _send_timeout_state(self):
+		timeout_value = None
+		abort_timer = self._abort_timer
+		if abort_timer is not None and not abort_timer.cancelled:
+			timeout_value = max(0, int(round(abort_timer.when - monotonic_time())))
+		self._plugin_manager.send_plugin_message(self._identifier, dict(powerOffWhenIdle=self.powerOffWhenIdle, type="timeout", timeout_value=timeout_value))
 
-			self._tasmota_mqtt_logger.debug("Waiting for heaters(%s) before shutting power off..." % ', '.join(heaters_above_waittemp))
-			time.sleep(5)
+	def _shutdown_system(self):
+		self._tasmota_mqtt_logger.debug("Automatically powering off enabled plugs.")
+		self.turn_off_relays([relay for relay in self._relays if relay.automaticShutdownEnabled])
 
-	##~~ Abort Power Off Timer
+	##~~ MQTT subscriptions
 
-	def _timer_start(self):
-		if self._abort_timer is not None:
-			return
+	def _subscribe_relays(self):
+		if self.subscription_mode == "wildcard":
+			# one subscription for all relays, messages are routed by parsing the topic
+			self._tasmota_mqtt_logger.debug("subscribing to %s", self._stat_topic_matcher.subscription)
+			self.mqtt_subscribe(self._stat_topic_matcher.subscription, self._on_mqtt_subscription)
+			if self.polling_mode == "device":
+				self.mqtt_subscribe(self._result_topic_matcher.subscription, self._on_mqtt_result)
+		else:
+			for relay in self._relays:
+				self._tasmota_mqtt_logger.debug("subscribing to %s", self.generate_mqtt_full_topic(relay, "stat"))
+				self.mqtt_subscribe(self.generate_mqtt_full_topic(relay, "stat"), self._on_mqtt_subscription, kwargs=dict(top=relay.topic,relayN=relay.relayN))
+			if self.polling_mode == "device":
+				for topic, relays in self._relays.devices():
+					self.mqtt_subscribe(self._relays.device_topic(topic, "stat", "RESULT"), self._on_mqtt_result)
+
+		# availability, Tasmota publishes Online/Offline retained as its last will
+		if self.subscription_mode == "wildcard":
+			self.mqtt_subscribe(self._lwt_topic_matcher.subscription, self._on_mqtt_lwt)
+		else:
+			for topic, relays in self._relays.devices():
+				self.mqtt_subscribe(self._relays.device_topic(topic, "tele", "LWT"), self._on_mqtt_lwt)
 
-		self._tasmota_mqtt_logger.debug("Starting abort power off timer.")
+		if self.energy_telemetry:
+			if self.subscription_mode == "wildcard":
+				self.mqtt_subscribe(self._sensor_topic_matcher.subscription, self._on_mqtt_sensor)
+			else:
+				for topic, relays in self._relays.devices():
+					self.mqtt_subscribe(self._relays.device_topic(topic, "tele", "SENSOR"), self._on_mqtt_sensor)
+
+	def _resubscribe_relays(self):
+		self.mqtt_unsubscribe(self._on_mqtt_subscription)
+		self.mqtt_unsubscribe(self._on_mqtt_result)
+		self.mqtt_unsubscribe(self._on_mqtt_sensor)
+		self.mqtt_unsubscribe(self._on_mqtt_lwt)
+		self._subscribe_relays()
+
+	##~~ Status polling
+
+	def _check_status(self):
+		# only relays that are unknown or haven't reported within the cache ttl are polled, and a poll
+		# that is still in flight isn't repeated. Offline devices are not polled at all
+		polled = []
+		if self.polling_mode == "device":
+			# one STATE request per device, the RESULT reply carries POWER1..n for all of its relays
+			for topic, relays in self._relays.devices():
+				if self._availability.is_offline(topic):
+					continue
+				if all(map(self._poller.is_fresh, relays)) or not self._poller.claim_device(topic):
+					continue
+				self._tasmota_mqtt_logger.debug("checking status of device %s", topic)
+				self.mqtt_publish(self._relays.device_topic(topic, "cmnd", "STATE"), "")
+				polled.extend("{}|{}".format(relay.topic, relay.relayN) for relay in relays)
+		else:
+			for relay in self._relays:
+				if self._availability.is_offline(relay.topic):
+					continue
+				if self._poller.is_fresh(relay) or not self._poller.claim_relay(relay):
+					continue
+				self._tasmota_mqtt_logger.debug("checking status of %s relay %s", relay.topic, relay.relayN)
+				self.mqtt_publish(self.generate_mqtt_full_topic(relay, "cmnd"),"")
+				polled.append("{}|{}".format(relay.topic, relay.relayN))
+		return polled
 
-		self._timeout_value = self.abortTimeout
-		self._abort_timer = RepeatedTimer(1, self._timer_task)
-		self._abort_timer.start()
+	##~~ Energy telemetry
 
-	def _timer_task(self):
-		if self._timeout_value is None:
+	def _record_print_energy(self, event, payload):
+		used = self._energy.print_finished()
+		if not used:
 			return
 
-		self._timeout_value -= 1
-		self._plugin_manager.send_plugin_message(self._identifier, dict(powerOffWhenIdle=self.powerOffWhenIdle, type="timeout", timeout_value=self._timeout_value))
-		if self._timeout_value <= 0:
-			if self._abort_timer is not None:
-				self._abort_timer.cancel()
-				self._abort_timer = None
-			self._shutdown_system()
+		record = dict(name=payload.get("name"), result=event, time=time.time(),
+					  energy=sum(used.values()), devices=used)
+		self._last_print_energy = record
+		self._tasmota_mqtt_logger.debug("Print %s used %.3f kWh", payload.get("name"), record["energy"])
+		self._plugin_manager.send_plugin_message(self._identifier, dict(type="print_energy", **record))
 
-	def _shutdown_system(self):
-		self._tasmota_mqtt_logger.debug("Automatically powering off enabled plugs.")
-		for relay in self._settings.get(['arrRelays']):
-			if relay.get("automaticShutdownEnabled", False):
-				self.turn_off(relay)
+		# keep the last prints' usage with the file, shows up in its metadata
+		origin, path = payload.get("origin"), payload.get("path")
+		if origin and path:
+			try:
+				metadata = self._file_manager.get_metadata(origin, path) or {}
+				history = metadata.get("tasmota_mqtt_energy", [])[-19:] + [record]
+				self._file_manager.set_additional_metadata(origin, path, "tasmota_mqtt_energy", history, overwrite=True)
+			except Exception:
+				self._logger.exception("Could not store the energy used by {}".format(path))
+
+	##~~ Scheduled actions
+
+	def _schedule_relay_action(self, kind, relay, delay, function, args=None):
+		# one pending action per kind and relay, scheduling again replaces the previous one
+		return self._scheduler.schedule(delay, function, args=args,
+										key=(kind,) + relay_key(relay.topic, relay.relayN),
+										description="{} {}|{}".format(kind, relay.topic, relay.relayN))
+
+	def _cancel_relay_actions(self, relay, *kinds):
+		for kind in kinds:
+			if self._scheduler.cancel((kind,) + relay_key(relay.topic, relay.relayN)):
+				self._tasmota_mqtt_logger.debug("Cancelled pending %s action for %s|%s", kind, relay.topic, relay.relayN)
+
+	def _sequence_power_on(self, relays, reason):
+		# switched on from the scheduler thread, staggered and by priority
+		for relay, delay in self._power_on.start(relays):
+			self._tasmota_mqtt_logger.debug("powering on %s|%s in %ss due to %s.", relay.topic, relay.relayN, delay, reason)
+
+	def _schedule_power_on(self, relay, delay):
+		self._schedule_relay_action("power", relay, delay, self.turn_on, [relay])
+
+	def _run_system_command(self, command, relay):
+		# runs on the command workers, keeps the scheduler thread free
+		self._commands.submit(command, label="{}|{}".format(relay.topic, relay.relayN))
 
 	##~~ Utility functions
 
+	def _get_int_setting(self, key, minimum=0):
+		# a number field cleared in the settings form is saved as None, that means the default
+		value = self._settings.get_int([key], min=minimum)
+		return value if value is not None else self.get_settings_defaults()[key]
+
+	def _rebuild_relays(self):
+		full_topic_pattern = self._settings.get(["full_topic_pattern"])
+		self._relays.rebuild(self._settings.get(["arrRelays"]), full_topic_pattern)
+		for problem in self._relays.problems:
+			self._logger.warning("Relay settings: %s", problem)
+		# commands in flight or queued for offline devices must not outlive their relay's settings
+		self._acks.reconcile(self._relays.get)
+		self._availability.reconcile(self._relays.get)
+		self._stat_topic_matcher = TopicMatcher(full_topic_pattern, "stat")
+		self._result_topic_matcher = TopicMatcher(full_topic_pattern, "stat", command="RESULT", indexed=False)
+		self._sensor_topic_matcher = TopicMatcher(full_topic_pattern, "tele", command="SENSOR", indexed=False)
+		self._lwt_topic_matcher = TopicMatcher(full_topic_pattern, "tele", command="LWT", indexed=False)
+		# live states come from the state store, the value saved in settings is only a fallback for older configs
+		for relay in self._relays:
+			relay.currentstate = RelayState.parse(self._relay_state.get(relay.topic, relay.relayN, relay.currentstate))
+		self._compile_gcode_hook()
+
 	def generate_mqtt_full_topic(self, relay, prefix):
-		full_topic = re.sub(r'%topic%', relay["topic"], self._settings.get(["full_topic_pattern"]))
-		full_topic = re.sub(r'%prefix%', prefix, full_topic)
-		full_topic = full_topic + "POWER" + relay["relayN"]
+		full_topic = self._relays.full_topic(relay, prefix)
+		if full_topic is None:
+			full_topic = format_full_topic(self._settings.get(["full_topic_pattern"]), relay.topic, prefix, relay.relayN)
 		return full_topic
 
 	##~~ WizardPlugin mixin
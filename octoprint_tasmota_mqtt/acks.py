@@ -0,0 +1,130 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+
+from octoprint.util import monotonic_time
+
+from .metrics import Histogram
+from .registry import relay_key
+
+
+class PendingCommand(object):
+	def __init__(self, relay, state):
+		self.relay = relay
+		self.state = state
+		self.attempts = 1
+		self.sent = monotonic_time()
+
+
+class CommandTracker(object):
+	"""
+	Tracks power commands until the device reports the requested state.
+
+	Every published command is pending until a stat report for its relay carries the requested state, the
+	round trip from the last publish is then recorded in the device's latency histogram. Unanswered
+	commands are published again by ``resend`` after ``timeout`` seconds, doubling the wait each time up
+	to ``max_delay``. After ``retries`` resends ``on_timeout`` is called with the relay and state and the
+	command is given up.
+	"""
+
+	def __init__(self, scheduler, resend, on_timeout, timeout=3.0, retries=2, max_delay=30.0, metrics=None):
+		self._scheduler = scheduler
+		self._resend = resend
+		self._on_timeout = on_timeout
+		self.timeout = timeout
+		self.retries = retries
+		self._max_delay = max_delay
+		self._pending = {}
+		self._latency = {}
+		self._metrics = metrics
+		self._mutex = threading.Lock()
+
+	def sent(self, relay, state):
+		key = relay_key(relay.topic, relay.relayN)
+		with self._mutex:
+			self._pending[key] = PendingCommand(relay, state)
+		self._schedule(key, self.timeout)
+
+	def acknowledged(self, relay, state):
+		key = relay_key(relay.topic, relay.relayN)
+		with self._mutex:
+			command = self._pending.get(key)
+			if command is None or command.state != state:
+				return False
+			del self._pending[key]
+			histogram = self._latency.get(relay.topic)
+			if histogram is None:
+				if self._metrics is not None:
+					histogram = self._metrics.histogram("command_latency_seconds", "Power command round trip", device=relay.topic)
+				else:
+					histogram = Histogram()
+				self._latency[relay.topic] = histogram
+		self._scheduler.cancel(("ack",) + key)
+		histogram.observe(monotonic_time() - command.sent)
+		return True
+
+	def is_pending(self, relay, state):
+		with self._mutex:
+			command = self._pending.get(relay_key(relay.topic, relay.relayN))
+		return command is not None and command.state == state
+
+	def cancel_device(self, topic):
+		# gives up all pending commands of a device without calling on_timeout, returns them
+		device = relay_key(topic, "")[0]
+		with self._mutex:
+			keys = [key for key in self._pending if key[0] == device]
+			commands = [self._pending.pop(key) for key in keys]
+		for key in keys:
+			self._scheduler.cancel(("ack",) + key)
+		return [(command.relay, command.state) for command in commands]
+
+	def reconcile(self, lookup):
+		# after the relays were rebuilt: commands of removed relays are dropped, the others are pointed at
+		# the new relay records so resends use the current settings
+		with self._mutex:
+			dropped = []
+			for key, command in list(self._pending.items()):
+				relay = lookup(command.relay.topic, command.relay.relayN)
+				if relay is None:
+					del self._pending[key]
+					dropped.append(key)
+				else:
+					command.relay = relay
+		for key in dropped:
+			self._scheduler.cancel(("ack",) + key)
+		return len(dropped)
+
+	def pending(self):
+		now = monotonic_time()
+		with self._mutex:
+			return [dict(topic=command.relay.topic, relayN=command.relay.relayN, state=command.state,
+						 attempts=command.attempts, age=now - command.sent) for command in self._pending.values()]
+
+	def latency(self):
+		with self._mutex:
+			histograms = list(self._latency.items())
+		return dict((device, histogram.as_dict()) for device, histogram in histograms)
+
+	def _schedule(self, key, delay):
+		self._scheduler.schedule(delay, self._expired, args=[key], key=("ack",) + key,
+								 description="ack {}|{}".format(*key))
+
+	def _expired(self, key):
+		with self._mutex:
+			command = self._pending.get(key)
+			if command is None:
+				return
+			gave_up = command.attempts > self.retries
+			if gave_up:
+				del self._pending[key]
+			else:
+				command.attempts += 1
+				command.sent = monotonic_time()
+
+		if gave_up:
+			self._on_timeout(command.relay, command.state)
+			return
+
+		self._resend(command.relay, command.state)
+		self._schedule(key, min(self.timeout * 2 ** (command.attempts - 1), self._max_delay))
@@ -0,0 +1,76 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+
+from octoprint.util import monotonic_time
+
+from .registry import relay_key
+
+
+class DeviceAvailability(object):
+	"""
+	Online state of the devices from their ``tele/%topic%/LWT`` messages.
+
+	A device is only considered offline after it reported ``Offline``, devices that never sent their LWT
+	are treated as available. Power commands for an offline device are kept here, the latest one per relay,
+	and handed back by :meth:`update` when the device reports ``Online`` again. Commands older than
+	``max_age`` seconds are dropped instead, with a ``max_age`` of 0 nothing is kept. ``sent`` marks commands
+	that were already published once, so only the power command itself is left to repeat.
+	"""
+
+	def __init__(self, max_age=300):
+		self.max_age = max_age
+		self._online = {}
+		self._queued = {}
+		self._mutex = threading.Lock()
+
+	def update(self, topic, payload):
+		"""Records an LWT payload, returns the queued ``(relay, state, sent)`` if the device just came back online."""
+		online = payload.strip().lower() == "online"
+		device = relay_key(topic, "")[0]
+		with self._mutex:
+			was_online = self._online.get(device, (topic, None))[1]
+			self._online[device] = (topic, online)
+			if not online or was_online is not False:
+				return []
+			queued = self._queued.pop(device, {})
+
+		now = monotonic_time()
+		return [(relay, state, sent) for relay, state, since, sent in queued.values() if now - since <= self.max_age]
+
+	def is_offline(self, topic):
+		return self._online.get(relay_key(topic, "")[0], (topic, None))[1] is False
+
+	def queue(self, relay, state, sent=False):
+		"""Keeps a command for an offline device, returns ``False`` if queueing is disabled."""
+		if self.max_age <= 0:
+			return False
+		key = relay_key(relay.topic, relay.relayN)
+		with self._mutex:
+			self._queued.setdefault(key[0], {})[key] = (relay, state, monotonic_time(), sent)
+		return True
+
+	def reconcile(self, lookup):
+		# after the relays were rebuilt: drops queued commands of removed relays, points the others at the
+		# new relay records
+		with self._mutex:
+			for device, commands in list(self._queued.items()):
+				for key, (relay, state, since, sent) in list(commands.items()):
+					current = lookup(relay.topic, relay.relayN)
+					if current is None:
+						del commands[key]
+					else:
+						commands[key] = (current, state, since, sent)
+				if not commands:
+					del self._queued[device]
+
+	def offline(self):
+		with self._mutex:
+			return sorted(topic for topic, online in self._online.values() if not online)
+
+	def queued(self):
+		now = monotonic_time()
+		with self._mutex:
+			return [dict(topic=relay.topic, relayN=relay.relayN, state=state, age=now - since)
+					for commands in self._queued.values() for relay, state, since, _ in commands.values()]
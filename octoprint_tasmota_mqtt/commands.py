@@ -0,0 +1,133 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import collections
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+from octoprint.util import monotonic_time
+
+# queued in place of a job to wake an idle worker that should exit
+_STOP = None
+
+
+class CommandExecutor(object):
+	"""
+	Bounded worker pool for the relays' system command hooks.
+
+	At most ``workers`` commands run at the same time, each is killed after ``timeout`` seconds and its
+	output is written to the debug log. The most recent runs are kept for the API. Lowering ``workers``
+	never waits, surplus workers exit once they are done with their current command.
+	"""
+
+	def __init__(self, workers=2, timeout=60, max_queued=50, history=20, logger=None):
+		self._queue = queue.Queue(maxsize=max_queued)
+		self._workers = []
+		self._target_workers = workers
+		self._stopping = 0
+		self._mutex = threading.Lock()
+		self._runs = collections.deque(maxlen=history)
+		self._logger = logger or logging.getLogger("octoprint.plugins.tasmota_mqtt")
+		self.timeout = timeout
+
+	def set_workers(self, workers):
+		with self._mutex:
+			self._target_workers = max(1, workers)
+			self._stopping = max(0, len(self._workers) - self._target_workers)
+			stopping = self._stopping
+		for _ in range(stopping):
+			try:
+				self._queue.put_nowait(_STOP)
+			except queue.Full:
+				# busy workers check for surplus after every command anyway
+				break
+
+	def submit(self, command, label=None):
+		with self._mutex:
+			self._stopping = max(0, len(self._workers) - self._target_workers)
+			while len(self._workers) < self._target_workers:
+				worker = threading.Thread(target=self._work, name="TasmotaMQTT command worker")
+				worker.daemon = True
+				worker.start()
+				self._workers.append(worker)
+
+		try:
+			self._queue.put_nowait((command, label))
+		except queue.Full:
+			self._logger.warning("Too many system commands queued, dropping %s", command)
+			return False
+		return True
+
+	def runs(self):
+		return list(self._runs)
+
+	def _work(self):
+		while True:
+			with self._mutex:
+				if self._stopping > 0:
+					# only a worker that actually exits leaves the pool
+					self._stopping -= 1
+					self._workers.remove(threading.current_thread())
+					return
+			job = self._queue.get()
+			if job is _STOP:
+				# the check above decides, the pool may have grown again since the wake up was queued
+				continue
+			try:
+				self._run(*job)
+			except Exception:
+				self._logger.exception("Error while running system command %s", job[0])
+
+	def _run(self, command, label):
+		self._logger.debug("Running system command for %s: %s", label, command)
+		started = time.time()
+		start = monotonic_time()
+		timed_out = False
+
+		kwargs = dict(shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		if os.name == "posix":
+			# own process group so a timeout also takes down whatever the shell started
+			kwargs["preexec_fn"] = os.setsid
+		process = subprocess.Popen(command, **kwargs)
+
+		if hasattr(subprocess, "TimeoutExpired"):
+			try:
+				stdout, stderr = process.communicate(timeout=self.timeout)
+			except subprocess.TimeoutExpired:
+				timed_out = True
+				self._kill(process)
+				stdout, stderr = process.communicate()
+		else:
+			stdout, stderr = process.communicate()
+
+		duration = monotonic_time() - start
+		self._runs.append(dict(label=label, command=command, returncode=process.returncode, timed_out=timed_out,
+							   started=started, duration=duration))
+
+		if timed_out:
+			self._logger.warning("System command for %s killed after %ss: %s", label, self.timeout, command)
+		self._logger.debug("System command for %s finished with %s after %.2fs", label, process.returncode, duration)
+		if not self._logger.isEnabledFor(logging.DEBUG):
+			return
+		if stdout:
+			self._logger.debug("stdout: %s", stdout.decode("utf-8", "replace").rstrip())
+		if stderr:
+			self._logger.debug("stderr: %s", stderr.decode("utf-8", "replace").rstrip())
+
+	def _kill(self, process):
+		try:
+			if os.name == "posix":
+				os.killpg(process.pid, signal.SIGKILL)
+			else:
+				process.kill()
+		except OSError:
+			pass
@@ -0,0 +1,76 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import logging
+import threading
+
+from octoprint.printer import PrinterCallback
+
+
+class CooldownMonitor(PrinterCallback):
+	"""
+	Waits for the heaters to cool down, driven by the printer's temperature reports.
+
+	Registered once as a printer callback. While a cooldown is active every temperature report is checked
+	against the threshold and ``callback`` fires with the first report in which all watched heaters are at
+	or below it. No thread is held while waiting.
+	"""
+
+	def __init__(self, callback, logger=None):
+		self._callback = callback
+		self._logger = logger or logging.getLogger("octoprint.plugins.tasmota_mqtt")
+		self._mutex = threading.Lock()
+		self._threshold = 0
+		self._heaters = ("tool",)
+		self.active = False
+
+	def start(self, threshold, include_bed_and_chamber=False, temperatures=None):
+		with self._mutex:
+			self._threshold = threshold
+			self._heaters = ("tool", "bed", "chamber") if include_bed_and_chamber else ("tool",)
+			self.active = True
+
+		if temperatures is not None:
+			self._evaluate(temperatures)
+
+	def cancel(self):
+		with self._mutex:
+			was_active = self.active
+			self.active = False
+		return was_active
+
+	def on_printer_add_temperature(self, data):
+		if not self.active:
+			return
+		self._evaluate(data)
+
+	def _evaluate(self, temperatures):
+		heaters_above_threshold = []
+		for heater, entry in temperatures.items():
+			if not heater.startswith(self._heaters) or not isinstance(entry, dict):
+				continue
+
+			actual = entry.get("actual")
+			if actual is None:
+				# heater doesn't exist in fw
+				continue
+
+			try:
+				temp = float(actual)
+			except ValueError:
+				# not a float for some reason, skip it
+				continue
+
+			if temp > self._threshold:
+				heaters_above_threshold.append("%s=%sC" % (heater, temp))
+
+		if heaters_above_threshold:
+			self._logger.debug("Waiting for heaters(%s) before shutting power off...", ", ".join(heaters_above_threshold))
+			return
+
+		with self._mutex:
+			if not self.active:
+				return
+			self.active = False
+
+		self._callback()
@@ -0,0 +1,114 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import logging
+import logging.handlers
+import threading
+
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+from octoprint.util import monotonic_time
+
+
+class RateLimitFilter(logging.Filter):
+	"""
+	Limits debug records per call site.
+
+	Every logging call site (file and line) gets a token bucket refilled with ``rate`` records per second
+	holding up to ``burst`` records. Records beyond that are dropped and counted, the next record that gets
+	through from the same call site says how many were suppressed. A ``rate`` of 0 lets everything through.
+	Warnings and errors are never limited.
+	"""
+
+	def __init__(self, rate=5.0, burst=20):
+		logging.Filter.__init__(self)
+		self.rate = rate
+		self.burst = burst
+		self._buckets = {}
+		self._mutex = threading.Lock()
+
+	def filter(self, record):
+		if self.rate <= 0 or record.levelno > logging.DEBUG:
+			return True
+
+		key = (record.pathname, record.lineno)
+		now = monotonic_time()
+		with self._mutex:
+			tokens, last, suppressed = self._buckets.get(key, (self.burst, now, 0))
+			tokens = min(self.burst, tokens + (now - last) * self.rate)
+			if tokens < 1:
+				self._buckets[key] = (tokens, now, suppressed + 1)
+				return False
+			self._buckets[key] = (tokens - 1, now, 0)
+
+		if suppressed:
+			record.msg = "{} ({} similar messages suppressed)".format(record.msg, suppressed)
+		return True
+
+
+if hasattr(logging.handlers, "QueueHandler"):
+	class LazyQueueHandler(logging.handlers.QueueHandler):
+		"""
+		Hands records to the listener thread as they are.
+
+		The stock handler formats the message in the logging thread, here that is left to the listener. When
+		the queue is full records are dropped instead of blocking the caller.
+		"""
+
+		def __init__(self, record_queue):
+			logging.handlers.QueueHandler.__init__(self, record_queue)
+			self.dropped = 0
+
+		def prepare(self, record):
+			return record
+
+		def enqueue(self, record):
+			try:
+				self.queue.put_nowait(record)
+			except queue.Full:
+				self.dropped += 1
+else:
+	LazyQueueHandler = None
+
+
+class DebugLog(object):
+	"""
+	Asynchronous file logging for the plugin's debug logger.
+
+	Records are rate limited per call site and put on a bounded queue in the logging thread, formatting
+	and the file writes happen on a listener thread. Without ``QueueHandler`` (Python 2) the file handler
+	is attached directly.
+	"""
+
+	def __init__(self, logger, file_handler, rate=5.0, burst=20, max_queued=1000):
+		self._logger = logger
+		self._file_handler = file_handler
+		self.rate_limit = RateLimitFilter(rate=rate, burst=burst)
+		self._listener = None
+
+		if LazyQueueHandler is None:
+			self._handler = file_handler
+		else:
+			record_queue = queue.Queue(maxsize=max_queued)
+			self._handler = LazyQueueHandler(record_queue)
+			self._listener = logging.handlers.QueueListener(record_queue, file_handler)
+		self._handler.addFilter(self.rate_limit)
+
+	def start(self):
+		self._logger.addHandler(self._handler)
+		if self._listener is not None:
+			self._listener.start()
+
+	def stop(self):
+		# writes out what is still queued
+		self._logger.removeHandler(self._handler)
+		if self._listener is not None:
+			self._listener.stop()
+		self._file_handler.close()
+
+	@property
+	def dropped(self):
+		return getattr(self._handler, "dropped", 0)
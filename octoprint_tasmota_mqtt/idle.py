@@ -0,0 +1,90 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import logging
+import threading
+
+from octoprint.util import monotonic_time
+
+
+class IdleTracker(object):
+	"""
+	Plugin wide idle detection based on a last-activity timestamp.
+
+	``touch`` only stores a monotonic timestamp, so it is cheap enough to call for every queued line. A single
+	supervisor thread sleeps until the deadline derived from the last activity and re-checks it lazily when it
+	wakes up. The callback fires once per idle period; any activity after it fired starts a new period.
+	"""
+
+	def __init__(self, timeout, callback):
+		self._timeout = timeout
+		self._callback = callback
+		self._last_activity = monotonic_time()
+		self._fired_for = None
+		self._armed = False
+		self._wakeup = threading.Event()
+		self._thread = None
+		self._mutex = threading.Lock()
+		self._logger = logging.getLogger("octoprint.plugins.tasmota_mqtt")
+
+	@property
+	def armed(self):
+		return self._armed
+
+	@property
+	def idle_age(self):
+		return monotonic_time() - self._last_activity
+
+	@property
+	def remaining(self):
+		if not self._armed:
+			return None
+		return max(0.0, self._last_activity + self._timeout - monotonic_time())
+
+	def touch(self):
+		self._last_activity = monotonic_time()
+
+	def start(self):
+		with self._mutex:
+			self._fired_for = None
+			self._last_activity = monotonic_time()
+			self._armed = True
+			if self._thread is None:
+				self._thread = threading.Thread(target=self._run, name="TasmotaMQTT idle tracker")
+				self._thread.daemon = True
+				self._thread.start()
+		self._wakeup.set()
+
+	def stop(self):
+		self._armed = False
+		self._wakeup.set()
+
+	def set_timeout(self, timeout):
+		self._timeout = timeout
+		self._wakeup.set()
+
+	def _run(self):
+		while True:
+			if not self._armed:
+				self._wakeup.wait()
+				self._wakeup.clear()
+				continue
+
+			last_activity = self._last_activity
+			if last_activity == self._fired_for:
+				# already fired for this period, any activity since will have moved the deadline past our next wakeup
+				self._wakeup.wait(self._timeout)
+				self._wakeup.clear()
+				continue
+
+			remaining = last_activity + self._timeout - monotonic_time()
+			if remaining > 0:
+				self._wakeup.wait(remaining)
+				self._wakeup.clear()
+				continue
+
+			self._fired_for = last_activity
+			try:
+				self._callback()
+			except Exception:
+				self._logger.exception("Error while handling idle timeout")
@@ -0,0 +1,187 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import bisect
+import collections
+import threading
+
+from octoprint.util import monotonic_time
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MESSAGE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5)
+HOOK_BUCKETS = (0.000001, 0.000005, 0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.01)
+
+
+class Histogram(object):
+	"""
+	Bucketed distribution of observed values.
+
+	Keeps cumulative counts per upper bound in ``buckets`` plus the most recent ``window`` samples, which
+	the percentiles are computed from.
+	"""
+
+	def __init__(self, buckets=LATENCY_BUCKETS, window=200):
+		self._bounds = tuple(buckets)
+		self._counts = [0] * (len(self._bounds) + 1)
+		self._recent = collections.deque(maxlen=window)
+		self._mutex = threading.Lock()
+		self.count = 0
+		self.sum = 0.0
+
+	def observe(self, value):
+		with self._mutex:
+			self._counts[bisect.bisect_left(self._bounds, value)] += 1
+			self._recent.append(value)
+			self.count += 1
+			self.sum += value
+
+	def percentile(self, percent):
+		with self._mutex:
+			samples = sorted(self._recent)
+		if not samples:
+			return None
+		index = int(round(percent / 100.0 * (len(samples) - 1)))
+		return samples[index]
+
+	def buckets(self):
+		# cumulative, the last bucket is +Inf
+		with self._mutex:
+			counts = list(self._counts)
+		result = []
+		total = 0
+		for bound, count in zip(self._bounds + ("+Inf",), counts):
+			total += count
+			result.append((bound, total))
+		return result
+
+	def as_dict(self):
+		return dict(count=self.count,
+					sum=self.sum,
+					p50=self.percentile(50),
+					p90=self.percentile(90),
+					p99=self.percentile(99),
+					buckets=self.buckets())
+
+
+class Counter(object):
+	__slots__ = ("value",)
+
+	def __init__(self):
+		self.value = 0
+
+	def inc(self, amount=1):
+		# unlocked, a lost increment under contention is acceptable for a metric
+		self.value += amount
+
+
+class SampledTiming(object):
+	"""
+	Call counter for hot paths that only times one in ``sample_every`` calls.
+
+	``sample_every`` must be a power of two. Callers bump :attr:`calls` themselves and only time the call
+	when ``calls & mask`` is zero, so the common case costs an increment and a bit test.
+	"""
+
+	def __init__(self, histogram, sample_every=64):
+		self.histogram = histogram
+		self.calls = 0
+		self.mask = sample_every - 1
+
+	@property
+	def value(self):
+		return self.calls
+
+	def observe_since(self, start):
+		self.histogram.observe(monotonic_time() - start)
+
+
+class Metrics(object):
+	"""
+	Registry of the plugin's counters, histograms and gauges.
+
+	Metrics are registered on first use and identified by name and labels. :meth:`as_dict` and
+	:meth:`prometheus` render everything for the API, gauges are computed at that point.
+	"""
+
+	def __init__(self, prefix="tasmota_mqtt"):
+		self._prefix = prefix
+		self._families = collections.OrderedDict()
+		self._mutex = threading.Lock()
+
+	def counter(self, name, help, **labels):
+		return self._get(name, "counter", help, labels, Counter)
+
+	def histogram(self, name, help, buckets=LATENCY_BUCKETS, **labels):
+		return self._get(name, "histogram", help, labels, lambda: Histogram(buckets=buckets))
+
+	def timing(self, name, help, buckets=HOOK_BUCKETS, sample_every=64):
+		histogram = self.histogram(name + "_seconds", help + " (sampled)", buckets=buckets)
+		return self._get(name + "_calls_total", "counter", help, {}, lambda: SampledTiming(histogram, sample_every=sample_every))
+
+	def gauge(self, name, help, function):
+		self._get(name, "gauge", help, {}, lambda: function)
+
+	def _get(self, name, kind, help, labels, factory):
+		key = tuple(sorted(labels.items()))
+		family = self._families.get(name)
+		if family is not None:
+			metric = family[2].get(key)
+			if metric is not None:
+				return metric
+
+		with self._mutex:
+			family = self._families.get(name)
+			if family is None:
+				family = self._families[name] = (kind, help, collections.OrderedDict())
+			metric = family[2].get(key)
+			if metric is None:
+				metric = family[2][key] = factory()
+		return metric
+
+	def _samples(self):
+		with self._mutex:
+			families = [(name, kind, help, list(metrics.items())) for name, (kind, help, metrics) in self._families.items()]
+		for name, kind, help, metrics in families:
+			yield self._prefix + "_" + name, kind, help, metrics
+
+	def as_dict(self):
+		result = collections.OrderedDict()
+		for name, kind, help, metrics in self._samples():
+			values = []
+			for labels, metric in metrics:
+				if kind == "histogram":
+					value = metric.as_dict()
+				elif kind == "gauge":
+					value = metric()
+				else:
+					value = metric.value
+				values.append(dict(labels=dict(labels), value=value))
+			result[name] = dict(type=kind, help=help, values=values)
+		return result
+
+	def prometheus(self):
+		lines = []
+		for name, kind, help, metrics in self._samples():
+			lines.append("# HELP {} {}".format(name, help))
+			lines.append("# TYPE {} {}".format(name, kind))
+			for labels, metric in metrics:
+				if kind == "histogram":
+					for bound, count in metric.buckets():
+						lines.append("{}_bucket{} {}".format(name, _labels(labels + (("le", bound),)), count))
+					lines.append("{}_sum{} {}".format(name, _labels(labels), metric.sum))
+					lines.append("{}_count{} {}".format(name, _labels(labels), metric.count))
+				elif kind == "gauge":
+					lines.append("{}{} {}".format(name, _labels(labels), metric()))
+				else:
+					lines.append("{}{} {}".format(name, _labels(labels), metric.value))
+		return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+	if not labels:
+		return ""
+	return "{" + ",".join('{}="{}"'.format(key, _escape(value)) for key, value in labels) + "}"
+
+
+def _escape(value):
+	return "{}".format(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
@@ -0,0 +1,178 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+
+class RelayState(object):
+	"""The states a relay can be in, reported payloads other than ON and OFF are ``UNKNOWN``."""
+
+	ON = "ON"
+	OFF = "OFF"
+	UNKNOWN = "UNKNOWN"
+
+	INVERTED = {ON: OFF, OFF: ON}
+
+	@classmethod
+	def parse(cls, value):
+		value = "{}".format(value).strip().upper()
+		return value if value in (cls.ON, cls.OFF) else cls.UNKNOWN
+
+
+class InvalidRelay(ValueError):
+	pass
+
+
+def _text(value):
+	if value is None:
+		return ""
+	return "{}".format(value).strip()
+
+
+def _flag(value):
+	if isinstance(value, bool):
+		return value
+	if isinstance(value, (int, float)):
+		return value != 0
+	return "{}".format(value).strip().lower() in ("true", "1", "yes", "on")
+
+
+def _number(value):
+	# the relay editor uses text inputs, delays arrive as "15" as often as 15
+	if isinstance(value, bool):
+		raise ValueError(value)
+	if isinstance(value, (int, float)):
+		return int(value)
+	value = "{}".format(value).strip()
+	return int(float(value)) if value else 0
+
+
+def _seconds(value):
+	value = _number(value)
+	if value < 0:
+		raise ValueError(value)
+	return value
+
+
+# (field, parser, default) of every relay setting, in the order of the relay editor. A default of None
+# marks a required field. Fields missing from the stored relays, e.g. ones added by a plugin update, are
+# filled in with their default, that is all the settings migration needs to do.
+RELAY_SCHEMA = (
+	("topic", _text, None),
+	("relayN", _text, ""),
+	("icon", _text, "icon-bolt"),
+	("label", _text, ""),
+	("groups", _text, ""),
+	("showInNavbar", _flag, True),
+	("event_on_upload", _flag, False),
+	("event_on_startup", _flag, False),
+	("event_on_connect", _flag, False),
+	("event_on_disconnect", _flag, False),
+	("powerOnPriority", _number, 0),
+	("automaticShutdownEnabled", _flag, False),
+	("warn", _flag, True),
+	("warnPrinting", _flag, False),
+	("invertedLogic", _flag, False),
+	("connect", _flag, False),
+	("connectOnDelay", _seconds, 15),
+	("disconnect", _flag, False),
+	("disconnectOffDelay", _seconds, 0),
+	("errorEvent", _flag, False),
+	("disconnectAutoOffDelay", _seconds, 30),
+	("gcode", _flag, False),
+	("gcodeOnDelay", _seconds, 0),
+	("gcodeOffDelay", _seconds, 0),
+	("sysCmdOn", _flag, False),
+	("sysCmdRunOn", _text, ""),
+	("sysCmdOnDelay", _seconds, 0),
+	("sysCmdOff", _flag, False),
+	("sysCmdRunOff", _text, ""),
+	("sysCmdOffDelay", _seconds, 0),
+	("currentstate", RelayState.parse, RelayState.UNKNOWN),
+)
+
+RELAY_FIELDS = tuple(field for field, _, _ in RELAY_SCHEMA)
+
+
+class Relay(object):
+	"""
+	One configured relay, parsed and validated once from its settings entry.
+
+	Delays are ints, flags are bools and ``currentstate`` is one of :class:`RelayState`. Invalid values
+	fall back to the field's default and are listed in :attr:`problems`, a missing topic raises
+	:class:`InvalidRelay`.
+	"""
+
+	__slots__ = RELAY_FIELDS + ("problems", "_reported")
+
+	def __init__(self, data):
+		problems = []
+		for field, parse, default in RELAY_SCHEMA:
+			value = data.get(field)
+			if value is None:
+				if default is None:
+					raise InvalidRelay("{} is missing".format(field))
+				value = default
+			else:
+				try:
+					value = parse(value)
+				except (TypeError, ValueError):
+					if default is None:
+						raise InvalidRelay("{} is invalid: {!r}".format(field, value))
+					problems.append("{} is invalid: {!r}, using {!r}".format(field, value, default))
+					value = default
+			setattr(self, field, value)
+
+		if not self.topic:
+			raise InvalidRelay("topic is empty")
+		self.problems = problems
+		# maps the reported POWER payload to the relay's logical state
+		self._reported = RelayState.INVERTED if self.invertedLogic else {RelayState.ON: RelayState.ON, RelayState.OFF: RelayState.OFF}
+
+	def state_from_report(self, payload):
+		return self._reported.get(payload.strip().upper(), RelayState.UNKNOWN)
+
+	def power_payload(self, state):
+		return self._reported.get(state, state)
+
+	@property
+	def name(self):
+		return "{}|{}".format(self.topic, self.relayN)
+
+	def as_dict(self):
+		return dict((field, getattr(self, field)) for field in RELAY_FIELDS)
+
+
+def migrate_relays(relays):
+	"""
+	Brings stored relay entries up to the current schema in one pass.
+
+	Returns the entries with every missing field set to its default and the unknown fields kept, ready to be
+	written back to the settings. Values are not validated here, that happens when the :class:`Relay` is built.
+	"""
+	migrated = []
+	for data in relays or []:
+		if not isinstance(data, dict):
+			continue
+		entry = dict(data)
+		for field, _, default in RELAY_SCHEMA:
+			if field not in entry and default is not None:
+				entry[field] = default
+		migrated.append(entry)
+	return migrated
+
+
+def parse_relays(relays):
+	"""Builds the :class:`Relay` records for the stored entries, returns them and a list of problems found."""
+	result = []
+	problems = []
+	for index, data in enumerate(relays or []):
+		if not isinstance(data, dict):
+			problems.append("Relay #{} is not a relay entry, ignored".format(index + 1))
+			continue
+		try:
+			relay = Relay(data)
+		except InvalidRelay as error:
+			problems.append("Relay #{} ({}|{}) ignored: {}".format(index + 1, data.get("topic"), data.get("relayN"), error))
+			continue
+		problems.extend("Relay {}: {}".format(relay.name, problem) for problem in relay.problems)
+		result.append(relay)
+	return result, problems
@@ -0,0 +1,55 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+
+from octoprint.util import monotonic_time
+
+from .model import RelayState
+from .registry import relay_key
+
+
+class StatusPoller(object):
+	"""
+	Decides which relays actually need a status poll.
+
+	Every state report marks its relay as seen. A relay is fresh for ``ttl`` seconds after that, and a
+	poll is only published for relays that are stale or still ``UNKNOWN``. A poll that is in flight
+	claims its relay or device for ``in_flight_timeout`` seconds, so concurrent checks (several tabs
+	loading at once) share one publish. A reply releases the claim right away.
+	"""
+
+	def __init__(self, ttl=300, in_flight_timeout=10):
+		self.ttl = ttl
+		self._in_flight_timeout = in_flight_timeout
+		self._last_seen = {}
+		self._in_flight = {}
+		self._mutex = threading.Lock()
+
+	def seen(self, topic, relayN):
+		key = relay_key(topic, relayN)
+		with self._mutex:
+			self._last_seen[key] = monotonic_time()
+			self._in_flight.pop(key, None)
+			self._in_flight.pop(key[:1], None)
+
+	def is_fresh(self, relay):
+		if relay.currentstate == RelayState.UNKNOWN or self.ttl <= 0:
+			return False
+		last_seen = self._last_seen.get(relay_key(relay.topic, relay.relayN))
+		return last_seen is not None and monotonic_time() - last_seen < self.ttl
+
+	def claim_relay(self, relay):
+		return self._claim(relay_key(relay.topic, relay.relayN))
+
+	def claim_device(self, topic):
+		return self._claim(relay_key(topic, "")[:1])
+
+	def _claim(self, key):
+		now = monotonic_time()
+		with self._mutex:
+			claimed = self._in_flight.get(key)
+			if claimed is not None and now - claimed < self._in_flight_timeout:
+				return False
+			self._in_flight[key] = now
+			return True
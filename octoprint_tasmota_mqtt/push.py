@@ -0,0 +1,48 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+
+from .registry import relay_key
+
+
+class PushChannel(object):
+	"""
+	Coalesces relay state changes into batched plugin messages.
+
+	Changes are collected for ``window`` seconds and then sent to the browser as one ``relays`` message
+	holding only the relays that changed, with the latest state per relay.
+	"""
+
+	def __init__(self, send, scheduler, window=0.25):
+		self._send = send
+		self._scheduler = scheduler
+		self._window = window
+		self._pending = {}
+		self._flush_pending = False
+		self._mutex = threading.Lock()
+
+	def relay_changed(self, relay):
+		with self._mutex:
+			self._pending[relay_key(relay.topic, relay.relayN)] = self._entry(relay)
+			if self._flush_pending:
+				return
+			self._flush_pending = True
+		self._scheduler.schedule(self._window, self.flush, description="push relay states")
+
+	def flush(self):
+		with self._mutex:
+			self._flush_pending = False
+			relays, self._pending = list(self._pending.values()), {}
+		if relays:
+			self._send(dict(type="relays", relays=relays))
+
+	def snapshot(self, relays):
+		# a full snapshot supersedes whatever is still waiting to be sent
+		with self._mutex:
+			self._pending = {}
+		self._send(dict(type="relays", full=True, relays=[self._entry(relay) for relay in relays]))
+
+	@staticmethod
+	def _entry(relay):
+		return dict(topic=relay.topic, relayN=relay.relayN, currentstate=relay.currentstate)
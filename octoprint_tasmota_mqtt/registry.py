@@ -0,0 +1,106 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+from .model import parse_relays
+from .topics import format_full_topic
+
+
+def relay_key(topic, relayN):
+	return "{}".format(topic).upper(), "{}".format(relayN)
+
+
+def relay_groups(relay):
+	return [group.strip() for group in relay.groups.split(",") if group.strip()]
+
+
+class RelayRegistry(object):
+	"""
+	In-memory index of the configured relays.
+
+	Rebuilt from the ``arrRelays`` setting whenever the settings are loaded, migrated or saved, so that the
+	hot paths can look a relay up by ``(topic, relayN)``, by its full stat topic or by its device topic
+	without walking (and copying) the settings list on every call. Every entry is parsed into a
+	:class:`~octoprint_tasmota_mqtt.model.Relay` once here, entries that can't be used are left out and
+	listed in :attr:`problems`. Relays are also indexed by the groups
+	listed in their comma separated ``groups`` field, group names are case insensitive.
+
+	The full cmnd and stat topics of every relay are computed once and kept with the relay in the index. They
+	survive rebuilds and are only recomputed when the full topic pattern or the relay's topic or relayN changes.
+	"""
+
+	def __init__(self):
+		self._index = ([], {}, {}, {}, {})
+		self._full_topic_pattern = None
+		self._topics = {}
+		self._device_topics = {}
+		self.generation = 0
+		self.problems = []
+
+	def rebuild(self, relays, full_topic_pattern):
+		relays, problems = parse_relays(relays)
+		by_key = {}
+		by_stat_topic = {}
+		by_device = {}
+		by_group = {}
+
+		cached_topics = self._topics if full_topic_pattern == self._full_topic_pattern else {}
+		topics = {}
+
+		for relay in relays:
+			topic_key = (relay.topic, relay.relayN)
+			relay_topics = cached_topics.get(topic_key)
+			if relay_topics is None:
+				relay_topics = dict((prefix, format_full_topic(full_topic_pattern, relay.topic, prefix, relay.relayN)) for prefix in ("cmnd", "stat"))
+			topics[topic_key] = relay_topics
+
+			by_key.setdefault(relay_key(relay.topic, relay.relayN), relay)
+			by_stat_topic.setdefault(relay_topics["stat"], relay)
+			by_device.setdefault(relay.topic.upper(), []).append(relay)
+			for group in relay_groups(relay):
+				by_group.setdefault(group.upper(), []).append(relay)
+
+		# swap in one assignment so readers on other threads never see a half built index
+		self._index = (relays, by_key, by_stat_topic, by_device, by_group)
+		self._topics = topics
+		self.problems = problems
+		if full_topic_pattern != self._full_topic_pattern:
+			self._device_topics = {}
+		self._full_topic_pattern = full_topic_pattern
+		self.generation += 1
+
+	def get(self, topic, relayN):
+		return self._index[1].get(relay_key(topic, relayN))
+
+	def by_stat_topic(self, topic):
+		return self._index[2].get(topic)
+
+	def for_device(self, topic):
+		return self._index[3].get("{}".format(topic).upper(), [])
+
+	def for_group(self, group):
+		return self._index[4].get("{}".format(group).upper(), [])
+
+	def devices(self):
+		return [(relays[0].topic, relays) for relays in self._index[3].values()]
+
+	def device_topic(self, topic, prefix, command):
+		key = (topic, prefix, command)
+		full_topic = self._device_topics.get(key)
+		if full_topic is None:
+			full_topic = self._device_topics[key] = format_full_topic(self._full_topic_pattern, topic, prefix, "", command=command)
+		return full_topic
+
+	def full_topic(self, relay, prefix):
+		relay_topics = self._topics.get((relay.topic, relay.relayN))
+		if relay_topics is None:
+			return None
+		return relay_topics.get(prefix)
+
+	def as_list(self):
+		return [relay.as_dict() for relay in self._index[0]]
+
+	def __iter__(self):
+		return iter(self._index[0])
+
+	def __len__(self):
+		return len(self._index[0])
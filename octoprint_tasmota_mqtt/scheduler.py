@@ -0,0 +1,108 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import heapq
+import itertools
+import logging
+import threading
+
+from octoprint.util import monotonic_time
+
+
+class ScheduledAction(object):
+	"""Handle for a pending action, returned by :meth:`Scheduler.schedule`."""
+
+	def __init__(self, when, function, args, kwargs, key, description):
+		self.when = when
+		self.function = function
+		self.args = args
+		self.kwargs = kwargs
+		self.key = key
+		self.description = description
+		self.cancelled = False
+
+	def cancel(self):
+		self.cancelled = True
+
+	def as_dict(self, now):
+		return dict(key=list(self.key) if isinstance(self.key, tuple) else self.key,
+					description=self.description,
+					due_in=max(0.0, self.when - now))
+
+
+class Scheduler(object):
+	"""
+	Runs delayed actions from a single thread backed by a heap ordered by due time.
+
+	Actions scheduled with a ``key`` replace any still pending action with the same key, which is how pending
+	actions are cancelled and replaced per relay. Actions run on the scheduler thread and must not block.
+	"""
+
+	def __init__(self, name="TasmotaMQTT scheduler"):
+		self._name = name
+		self._queue = []
+		self._keys = {}
+		self._counter = itertools.count()
+		self._condition = threading.Condition()
+		self._thread = None
+		self._logger = logging.getLogger("octoprint.plugins.tasmota_mqtt")
+
+	def schedule(self, delay, function, args=None, kwargs=None, key=None, description=None):
+		action = ScheduledAction(monotonic_time() + max(0, delay), function, args or [], kwargs or {}, key, description)
+
+		with self._condition:
+			if key is not None:
+				previous = self._keys.get(key)
+				if previous is not None:
+					previous.cancel()
+				self._keys[key] = action
+
+			heapq.heappush(self._queue, (action.when, next(self._counter), action))
+
+			if self._thread is None:
+				self._thread = threading.Thread(target=self._run, name=self._name)
+				self._thread.daemon = True
+				self._thread.start()
+
+			self._condition.notify()
+
+		return action
+
+	def cancel(self, key):
+		with self._condition:
+			action = self._keys.pop(key, None)
+			if action is not None:
+				action.cancel()
+				self._condition.notify()
+		return action is not None
+
+	def pending(self):
+		now = monotonic_time()
+		with self._condition:
+			return [action.as_dict(now) for _, _, action in sorted(self._queue) if not action.cancelled]
+
+	def _run(self):
+		while True:
+			with self._condition:
+				while True:
+					while self._queue and self._queue[0][2].cancelled:
+						heapq.heappop(self._queue)
+
+					if not self._queue:
+						self._condition.wait()
+						continue
+
+					delay = self._queue[0][0] - monotonic_time()
+					if delay > 0:
+						self._condition.wait(delay)
+						continue
+
+					_, _, action = heapq.heappop(self._queue)
+					if action.key is not None and self._keys.get(action.key) is action:
+						del self._keys[action.key]
+					break
+
+			try:
+				action.function(*action.args, **action.kwargs)
+			except Exception:
+				self._logger.exception("Error while running scheduled action {}".format(action.description or action.function))
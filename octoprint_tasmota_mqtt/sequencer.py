@@ -0,0 +1,29 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+
+class PowerOnSequencer(object):
+	"""
+	Spreads switching on a set of relays over time.
+
+	Relays are ordered by their ``powerOnPriority`` (lowest first, ties keep the configured order) and
+	switched on ``concurrency`` at a time, ``interval`` seconds apart, so several power supplies on one
+	circuit don't draw their inrush current at the same instant. ``schedule`` is called with every relay
+	and its delay and is expected to switch it on later, on another thread. A ``concurrency`` or
+	``interval`` of 0 switches everything at once.
+	"""
+
+	def __init__(self, schedule, interval=2, concurrency=1):
+		self._schedule = schedule
+		self.interval = interval
+		self.concurrency = concurrency
+
+	def start(self, relays):
+		ordered = sorted(enumerate(relays), key=lambda item: (item[1].powerOnPriority, item[0]))
+		plan = []
+		for position, (_, relay) in enumerate(ordered):
+			step = position // self.concurrency if self.concurrency > 0 else 0
+			delay = step * max(0, self.interval)
+			self._schedule(relay, delay)
+			plan.append((relay, delay))
+		return plan
@@ -0,0 +1,110 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import io
+import json
+import logging
+import os
+import threading
+import time
+
+from octoprint.util import atomic_write, monotonic_time
+
+from .registry import relay_key
+
+
+class RelayStateStore(object):
+	"""
+	Live relay states, kept apart from the plugin settings.
+
+	States are held in memory and persisted to a small json file in the plugin's data folder. Writes are
+	coalesced: a change schedules a single flush ``flush_delay`` seconds out, but never sooner than
+	``min_flush_interval`` seconds after the previous one. Call :meth:`flush` on shutdown to write what is
+	still pending. ``version`` is bumped on every change, so readers can tell whether anything changed
+	since they last looked.
+	"""
+
+	def __init__(self, scheduler, flush_delay=2.0, min_flush_interval=30.0):
+		self._scheduler = scheduler
+		self._flush_delay = flush_delay
+		self._min_flush_interval = min_flush_interval
+		self._path = None
+		self._states = {}
+		self._dirty = False
+		self._flush_pending = False
+		self._last_flush = None
+		self.version = 0
+		self._mutex = threading.Lock()
+		self._write_mutex = threading.Lock()
+		self._logger = logging.getLogger("octoprint.plugins.tasmota_mqtt")
+
+	def load(self, path):
+		self._path = path
+		if not os.path.exists(path):
+			return
+
+		states = {}
+		try:
+			with io.open(path, "rt", encoding="utf-8") as f:
+				entries = json.load(f)
+			if not isinstance(entries, list):
+				raise ValueError("expected a list of relay states")
+			for entry in entries:
+				if not isinstance(entry, dict) or "topic" not in entry or "relayN" not in entry or "state" not in entry:
+					self._logger.warning("Ignoring invalid relay state entry in {}: {!r}".format(path, entry))
+					continue
+				states[relay_key(entry["topic"], entry["relayN"])] = entry
+		except Exception:
+			self._logger.exception("Could not read relay states from {}, starting without them".format(path))
+			return
+
+		with self._mutex:
+			self._states.update(states)
+
+	def get(self, topic, relayN, default=None):
+		entry = self._states.get(relay_key(topic, relayN))
+		if entry is None:
+			return default
+		return entry["state"]
+
+	def changed(self, topic, relayN):
+		entry = self._states.get(relay_key(topic, relayN))
+		if entry is None:
+			return None
+		return entry.get("changed")
+
+	def set(self, topic, relayN, state):
+		key = relay_key(topic, relayN)
+		with self._mutex:
+			entry = self._states.get(key)
+			if entry is not None and entry["state"] == state:
+				return False
+
+			self._states[key] = dict(topic=topic, relayN=relayN, state=state, changed=time.time())
+			self._dirty = True
+			self.version += 1
+
+			if not self._flush_pending and self._path is not None:
+				self._flush_pending = True
+				delay = self._flush_delay
+				if self._last_flush is not None:
+					delay = max(delay, self._last_flush + self._min_flush_interval - monotonic_time())
+				self._scheduler.schedule(delay, self.flush, description="flush relay states")
+		return True
+
+	def flush(self):
+		with self._write_mutex:
+			with self._mutex:
+				self._flush_pending = False
+				if not self._dirty or self._path is None:
+					return
+				entries = [dict(entry) for entry in self._states.values()]
+				self._dirty = False
+				self._last_flush = monotonic_time()
+
+			try:
+				with atomic_write(self._path, mode="wt") as f:
+					f.write(json.dumps(entries))
+			except Exception:
+				self._logger.exception("Could not write relay states to {}".format(self._path))
+				self._dirty = True
@@ -5,6 +5,39 @@
  * License: AGPLv3
  */
 $(function() {
+	// jQuery UI, knockout-sortable and the icon picker are only needed by the relay list and editor in the
+	// settings, they are loaded the first time the settings are opened. Libraries that are already on the
+	// page, e.g. from another plugin, are not loaded again.
+	var settingsAssets;
+
+	function loadScript(path, loaded) {
+		var deferred = $.Deferred();
+		if (loaded()) {
+			return deferred.resolve().promise();
+		}
+		var script = document.createElement("script");
+		script.src = BASEURL + "plugin/tasmota_mqtt/static/" + path;
+		script.onload = function() { deferred.resolve(); };
+		script.onerror = function() { deferred.reject(path); };
+		document.head.appendChild(script);
+		return deferred.promise();
+	}
+
+	function loadSettingsAssets() {
+		if (settingsAssets === undefined) {
+			$("<link>", {rel: "stylesheet", href: BASEURL + "plugin/tasmota_mqtt/static/css/fontawesome-iconpicker.css"}).appendTo("head");
+			settingsAssets = loadScript("js/jquery-ui.min.js", function() { return $.fn.sortable !== undefined; })
+				.then(function() { return loadScript("js/knockout-sortable.1.2.0.js", function() { return ko.bindingHandlers.sortable !== undefined; }); })
+				.then(function() { return loadScript("js/fontawesome-iconpicker.js", function() { return $.fn.iconpicker !== undefined; }); })
+				.then(function() { return loadScript("js/ko.iconpicker.js", function() { return ko.bindingHandlers.iconpicker !== undefined; }); });
+			settingsAssets.fail(function() {
+				// try again the next time the settings are opened
+				settingsAssets = undefined;
+			});
+		}
+		return settingsAssets;
+	}
+
 	function TasmotaMQTTViewModel(parameters) {
 		var self = this;
 
@@ -14,6 +47,8 @@ $(function() {
 		self.processing = ko.observableArray([]);
 		self.arrRelays = ko.observableArray();
 		self.selectedRelay = ko.observable();
+		self.settingsAssetsLoaded = ko.observable(false);
+		self.settingsAssetsFailed = ko.observable(false);
 		self.isPrinting = ko.observable(false);
 		self.automaticShutdownEnabled = ko.observable(false);
 		self.filteredSmartplugs = ko.computed(function(){
@@ -87,9 +122,49 @@ $(function() {
 			}
 		}
 
+		self.startTimeoutCountdown = function(timeoutValue) {
+			// the server only sends the remaining seconds when the countdown starts, tick locally from there
+			self.timeoutDeadline = Date.now() + timeoutValue * 1000;
+			if (typeof self.timeoutInterval == "undefined") {
+				self.timeoutInterval = setInterval(self.updateTimeoutPopup, 1000);
+			}
+			self.updateTimeoutPopup();
+		}
+
+		self.updateTimeoutPopup = function() {
+			var remaining = Math.max(0, Math.round((self.timeoutDeadline - Date.now()) / 1000));
+			self.timeoutPopupOptions.text = self.timeoutPopupText + remaining;
+			if (typeof self.timeoutPopup != "undefined") {
+				self.timeoutPopup.update(self.timeoutPopupOptions);
+			} else {
+				self.timeoutPopup = new PNotify(self.timeoutPopupOptions);
+				self.timeoutPopup.get().on('pnotify.cancel', function() {self.abortShutdown(true);});
+			}
+		}
+
+		self.stopTimeoutCountdown = function() {
+			if (typeof self.timeoutInterval != "undefined") {
+				clearInterval(self.timeoutInterval);
+				self.timeoutInterval = undefined;
+			}
+			if (typeof self.timeoutPopup != "undefined") {
+				self.timeoutPopup.remove();
+				self.timeoutPopup = undefined;
+			}
+		}
+
+		self.updateRelayState = function(data) {
+			var relay = ko.utils.arrayFirst(self.settingsViewModel.settings.plugins.tasmota_mqtt.arrRelays(),function(item){
+				return (item.topic() == data.topic) && (item.relayN() == data.relayN);
+				});
+			if (relay && relay.currentstate() != data.currentstate) {
+				relay.currentstate(data.currentstate);
+			}
+			self.processing.remove(data.topic + '|' + data.relayN);
+		}
+
 		self.abortShutdown = function(abortShutdownValue) {
-			self.timeoutPopup.remove();
-			self.timeoutPopup = undefined;
+			self.stopTimeoutCountdown();
 			$.ajax({
 				url: API_BASEURL + "plugin/tasmota_mqtt",
 				type: "POST",
@@ -119,6 +194,22 @@ $(function() {
 					command: "checkStatus"
 				}),
 				contentType: "application/json; charset=UTF-8"
+			}).done(function(data) {
+				// cached states, relays that had to be polled follow as plugin messages
+				ko.utils.arrayForEach(data.relays, function(relay) {
+					if (data.polled.indexOf(relay.topic + '|' + relay.relayN) < 0) {
+						self.updateRelayState(relay);
+					}
+				});
+			});
+		}
+
+		self.onSettingsShown = function() {
+			loadSettingsAssets().done(function() {
+				self.settingsAssetsFailed(false);
+				self.settingsAssetsLoaded(true);
+			}).fail(function() {
+				self.settingsAssetsFailed(true);
 			});
 		}
 
@@ -153,30 +244,50 @@ $(function() {
 
 				if (data.type == "timeout") {
 					if ((data.timeout_value != null) && (data.timeout_value > 0)) {
-						self.timeoutPopupOptions.text = self.timeoutPopupText + data.timeout_value;
-						if (typeof self.timeoutPopup != "undefined") {
-							self.timeoutPopup.update(self.timeoutPopupOptions);
-						} else {
-							self.timeoutPopup = new PNotify(self.timeoutPopupOptions);
-							self.timeoutPopup.get().on('pnotify.cancel', function() {self.abortShutdown(true);});
-						}
+						self.startTimeoutCountdown(data.timeout_value);
 					} else {
-						if (typeof self.timeoutPopup != "undefined") {
-							self.timeoutPopup.remove();
-							self.timeoutPopup = undefined;
-						}
+						self.stopTimeoutCountdown();
 					}
 				}
 				return;
 			}
-			if (data.hasOwnProperty("topic")) {
-				var relay = ko.utils.arrayFirst(self.settingsViewModel.settings.plugins.tasmota_mqtt.arrRelays(),function(item){
-					return (item.topic() == data.topic) && (item.relayN() == data.relayN);
-					}) || {'topic':data.topic,'relayN':data.relayN,'currentstate':'UNKNOWN'};
-				if(relay.currentstate != data.currentstate) {
-					relay.currentstate(data.currentstate);
+			if (data.type == "sequence") {
+				if (data.step == "done") {
+					self.processing.remove(data.topic + '|' + data.relayN);
+				} else if (self.processing.indexOf(data.topic + '|' + data.relayN) < 0) {
+					self.processing.push(data.topic + '|' + data.relayN);
 				}
+				return;
+			}
+			if (data.type == "command_timeout") {
+				self.processing.remove(data.topic + '|' + data.relayN);
+				new PNotify({
+							title: 'Tasmota-MQTT Error',
+							text: 'No reply from ' + data.topic + (data.relayN ? '|' + data.relayN : '') + ' after switching it ' + data.state + '. Check that the device is online.',
+							type: 'error',
+							hide: false
+							});
+				return;
+			}
+			if (data.type == "command_offline") {
 				self.processing.remove(data.topic + '|' + data.relayN);
+				new PNotify({
+							title: 'Tasmota-MQTT',
+							text: data.topic + (data.relayN ? '|' + data.relayN : '') + ' is offline, it was not switched ' + data.state + '.' + (data.queued ? ' The command is sent when the device is back online.' : ''),
+							type: data.queued ? 'notice' : 'error',
+							hide: true
+							});
+				return;
+			}
+			if (data.type == "availability") {
+				return;
+			}
+			if (data.type == "relays") {
+				ko.utils.arrayForEach(data.relays, self.updateRelayState);
+				return;
+			}
+			if (data.hasOwnProperty("topic")) {
+				self.updateRelayState(data);
 				return;
 			}
 		};
@@ -258,7 +369,9 @@ $(function() {
 								'event_on_connect':ko.observable(false),
 								'event_on_disconnect':ko.observable(false),
                                 'label': ko.observable(''),
-                                'invertedLogic': ko.observable(false)} );
+                                'invertedLogic': ko.observable(false),
+                                'groups': ko.observable(''),
+                                'powerOnPriority': ko.observable(0)} );
 			self.settingsViewModel.settings.plugins.tasmota_mqtt.arrRelays.push(self.selectedRelay());
 			$("#TasmotaMQTTRelayEditor").modal("show");
 		}
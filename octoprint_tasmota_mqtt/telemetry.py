@@ -0,0 +1,177 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import array
+import threading
+import time
+
+from .registry import relay_key
+
+FIELDS = ("power", "voltage", "current", "total")
+
+# (name, seconds per sample, samples kept): raw reports, then 1 minute and 10 minute averages. With the
+# usual 5 to 10 second teleperiod this covers roughly the last half hour, 12 hours and 7 days.
+TIERS = (
+	("raw", 0, 360),
+	("minute", 60, 720),
+	("10min", 600, 1008),
+)
+
+
+class RingBuffer(object):
+	"""Fixed size series of timestamped samples, one ``array`` per field, oldest samples are overwritten."""
+
+	def __init__(self, capacity):
+		self._capacity = capacity
+		self._times = array.array("d", [0.0] * capacity)
+		self._values = [array.array("d", [0.0] * capacity) for _ in FIELDS]
+		self._next = 0
+		self._count = 0
+
+	def append(self, timestamp, values):
+		index = self._next
+		self._times[index] = timestamp
+		for series, value in zip(self._values, values):
+			series[index] = value
+		self._next = (index + 1) % self._capacity
+		self._count = min(self._count + 1, self._capacity)
+
+	def samples(self, since=None):
+		start = (self._next - self._count) % self._capacity
+		result = []
+		for offset in range(self._count):
+			index = (start + offset) % self._capacity
+			timestamp = self._times[index]
+			if since is not None and timestamp < since:
+				continue
+			result.append([timestamp] + [series[index] for series in self._values])
+		return result
+
+
+class _Bucket(object):
+	"""Running average of one downsampled interval, ``total`` is a counter so its last value is kept."""
+
+	def __init__(self, start):
+		self.start = start
+		self.sums = [0.0] * len(FIELDS)
+		self.count = 0
+
+	def add(self, values):
+		for index, value in enumerate(values):
+			self.sums[index] += value
+		self.count += 1
+
+	def result(self, values):
+		averages = [value / self.count for value in self.sums]
+		averages[FIELDS.index("total")] = values[FIELDS.index("total")]
+		return averages
+
+
+class DeviceSeries(object):
+	"""
+	Energy history of one device in several resolutions.
+
+	Every report goes into the raw buffer and into a running average per coarser tier, which is written to
+	that tier's buffer when its interval is over. Memory is fixed by the tier sizes.
+	"""
+
+	def __init__(self, tiers=TIERS):
+		self._tiers = [(name, interval, RingBuffer(capacity)) for name, interval, capacity in tiers]
+		self._buckets = {}
+		self._last_values = None
+		self.latest = None
+
+	def add(self, timestamp, values):
+		self.latest = [timestamp] + list(values)
+		for name, interval, buffer in self._tiers:
+			if not interval:
+				buffer.append(timestamp, values)
+				continue
+
+			bucket = self._buckets.get(name)
+			if bucket is not None and timestamp - bucket.start >= interval:
+				buffer.append(bucket.start, bucket.result(self._last_values))
+				bucket = None
+			if bucket is None:
+				bucket = self._buckets[name] = _Bucket(timestamp - timestamp % interval)
+			bucket.add(values)
+		self._last_values = values
+
+	def samples(self, resolution, since=None):
+		for name, _, buffer in self._tiers:
+			if name == resolution:
+				return buffer.samples(since=since)
+		raise ValueError("Unknown resolution: {}".format(resolution))
+
+
+def parse_energy(payload):
+	"""Power, Voltage, Current and Total from a tele SENSOR payload, ``None`` if it carries no ENERGY."""
+	energy = payload.get("ENERGY") if isinstance(payload, dict) else None
+	if not isinstance(energy, dict):
+		return None
+
+	values = []
+	for key in ("Power", "Voltage", "Current", "Total"):
+		value = energy.get(key, 0.0)
+		if isinstance(value, list):
+			# multi channel devices report one value per channel
+			value = sum(value) if key in ("Power", "Current") else (value[0] if value else 0.0)
+		try:
+			values.append(float(value))
+		except (TypeError, ValueError):
+			values.append(0.0)
+	return values
+
+
+class EnergyTelemetry(object):
+	"""
+	Energy reports of all devices plus the energy used by the current print.
+
+	``print_started`` remembers every device's energy counter, ``print_finished`` returns the difference
+	since then per device.
+	"""
+
+	def __init__(self, tiers=TIERS):
+		self._tiers = tiers
+		self._devices = {}
+		self._print_start = None
+		self._mutex = threading.Lock()
+		self.resolutions = [name for name, _, _ in tiers]
+
+	def add(self, topic, values, timestamp=None):
+		if timestamp is None:
+			timestamp = time.time()
+		with self._mutex:
+			series = self._devices.get(topic)
+			if series is None:
+				series = self._devices[topic] = DeviceSeries(self._tiers)
+			series.add(timestamp, values)
+
+	def history(self, resolution="raw", topic=None, since=None):
+		device_key = relay_key(topic, "")[0] if topic is not None else None
+		with self._mutex:
+			return dict((device, series.samples(resolution, since=since)) for device, series in self._devices.items()
+						if device_key is None or relay_key(device, "")[0] == device_key)
+
+	def latest(self):
+		with self._mutex:
+			return dict((device, dict(zip(("time",) + FIELDS, series.latest)))
+						for device, series in self._devices.items() if series.latest is not None)
+
+	def print_started(self):
+		with self._mutex:
+			self._print_start = dict((device, series.latest[1 + FIELDS.index("total")])
+									 for device, series in self._devices.items() if series.latest is not None)
+
+	def print_finished(self):
+		with self._mutex:
+			start, self._print_start = self._print_start, None
+			if start is None:
+				return None
+			used = {}
+			for device, total in start.items():
+				series = self._devices.get(device)
+				if series is not None and series.latest is not None:
+					# the counter can be reset on the device, never report negative usage
+					used[device] = max(0.0, series.latest[1 + FIELDS.index("total")] - total)
+		return used
@@ -0,0 +1,58 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+
+
+class TimelapseTracker(object):
+	"""
+	Tracks running timelapse renders and notifies a waiter when the last one has finished.
+
+	Renders are counted per movie, so overlapping renders are handled correctly. :meth:`when_idle` runs the
+	callback right away if nothing is rendering, otherwise from the event that finishes the last render.
+	"""
+
+	def __init__(self):
+		self._mutex = threading.Lock()
+		self._renders = {}
+		self._pending = None
+
+	@property
+	def waiting(self):
+		return self._pending is not None
+
+	def started(self, movie):
+		with self._mutex:
+			self._renders[movie] = self._renders.get(movie, 0) + 1
+
+	def finished(self, movie):
+		with self._mutex:
+			count = self._renders.get(movie)
+			if not count:
+				# not one we saw starting
+				return
+			if count > 1:
+				self._renders[movie] = count - 1
+			else:
+				del self._renders[movie]
+
+			if self._renders or self._pending is None:
+				return
+			callback, self._pending = self._pending, None
+
+		callback()
+
+	def when_idle(self, callback):
+		with self._mutex:
+			if self._renders:
+				self._pending = callback
+				return False
+
+		callback()
+		return True
+
+	def cancel(self):
+		with self._mutex:
+			was_waiting = self._pending is not None
+			self._pending = None
+		return was_waiting
@@ -0,0 +1,37 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import re
+
+
+def format_full_topic(full_topic_pattern, topic, prefix, relayN, command="POWER"):
+	return full_topic_pattern.replace("%topic%", topic).replace("%prefix%", prefix) + command + relayN
+
+
+class TopicMatcher(object):
+	"""
+	Wildcard subscription and precompiled parser for one prefix of a Tasmota full topic pattern.
+
+	For the pattern ``%topic%/%prefix%/`` and prefix ``stat`` this subscribes to ``+/stat/+`` and parses
+	``sonoff/stat/POWER2`` into ``("sonoff", "2")``. Topics for anything other than a relay's POWER state
+	don't match. Device level topics like ``stat/%topic%/RESULT`` are matched with ``indexed=False`` and
+	parse into ``("sonoff", "")``.
+	"""
+
+	def __init__(self, full_topic_pattern, prefix, command="POWER", indexed=True):
+		template = full_topic_pattern.replace("%prefix%", prefix) + command + ("%relay%" if indexed else "")
+
+		levels = template.split("/")
+		self.subscription = "/".join("+" if "%" in level else level for level in levels)
+
+		expression = re.escape(template)
+		expression = expression.replace(re.escape("%topic%"), r"(?P<topic>[^/]+?)", 1)
+		expression = expression.replace(re.escape("%topic%"), r"(?P=topic)")
+		expression = expression.replace(re.escape("%relay%"), r"(?P<relayN>\d*)")
+		self._expression = re.compile("^" + expression + "$")
+
+	def match(self, topic):
+		match = self._expression.match(topic)
+		if match is None:
+			return None
+		return match.group("topic"), match.groupdict().get("relayN") or ""
@@ -0,0 +1,106 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from octoprint.events import Events
+
+import octoprint_tasmota_mqtt
+from octoprint_tasmota_mqtt import TasmotaMQTTPlugin
+
+
+class _Settings(object):
+	def __init__(self, data):
+		self._data = data
+
+	def get(self, path, **kwargs):
+		return self._data[path[0]]
+
+	def get_int(self, path, **kwargs):
+		return int(self._data[path[0]])
+
+	def get_float(self, path, **kwargs):
+		return float(self._data[path[0]])
+
+	def get_boolean(self, path, **kwargs):
+		return bool(self._data[path[0]])
+
+	def set(self, path, value, **kwargs):
+		self._data[path[0]] = value
+
+	def save(self, *args, **kwargs):
+		pass
+
+
+class _PluginManager(object):
+	def send_plugin_message(self, identifier, data):
+		pass
+
+
+class _Printer(object):
+	"""Fires DISCONNECTED from another thread on every disconnect, even when already disconnected, like OctoPrint."""
+
+	def __init__(self):
+		self.plugin = None
+		self.disconnects = 0
+
+	def is_closed_or_error(self):
+		return True
+
+	def disconnect(self, *args, **kwargs):
+		self.disconnects += 1
+		threading.Thread(target=self.plugin.on_event, args=(Events.DISCONNECTED, {})).start()
+
+
+def _relay(**overrides):
+	relay = dict(topic="printer", relayN="1", currentstate="ON")
+	relay.update(overrides)
+	return relay
+
+
+class DisconnectSequenceTest(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.published = []
+
+		plugin = TasmotaMQTTPlugin()
+		data = plugin.get_settings_defaults()
+		data["arrRelays"] = [_relay(disconnect=True, disconnectOffDelay=1, event_on_disconnect=True, disconnectAutoOffDelay=2)]
+		plugin._settings = _Settings(data)
+		plugin._data_folder = self.folder
+		plugin._identifier = "tasmota_mqtt"
+		plugin._plugin_manager = _PluginManager()
+		plugin._printer = _Printer()
+		plugin._printer.plugin = plugin
+		plugin.on_settings_initialized()
+		plugin.mqtt_publish = self._publish
+		self.plugin = plugin
+
+	def _publish(self, topic, payload, *args, **kwargs):
+		if "/cmnd/" in topic:
+			self.published.append((topic, payload))
+
+	def tearDown(self):
+		shutil.rmtree(self.folder, True)
+
+	def test_disconnect_event_does_not_replace_power_off(self):
+		relay = self.plugin._relays.get("printer", "1")
+		self.plugin.turn_off(relay)
+
+		time.sleep(1.5)
+		self.assertEqual(self.published, [("printer/cmnd/POWER1", "OFF")])
+		self.plugin._on_mqtt_subscription("printer/stat/POWER1", b"OFF")
+		self.assertEqual(relay.currentstate, "OFF")
+
+		# nothing left to switch the relay off or disconnect the printer again
+		time.sleep(1)
+		self.assertEqual(self.published, [("printer/cmnd/POWER1", "OFF")])
+		self.assertEqual(self.plugin._printer.disconnects, 1)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,101 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import unittest
+
+from octoprint_tasmota_mqtt.registry import RelayRegistry
+from octoprint_tasmota_mqtt.topics import TopicMatcher, format_full_topic
+
+TOPIC_FIRST = "%topic%/%prefix%/"
+PREFIX_FIRST = "%prefix%/%topic%/"
+EXTRA_LEVELS = "home/%prefix%/tasmota/%topic%/"
+
+
+def relay(topic, relayN=""):
+	return dict(topic=topic, relayN=relayN)
+
+
+class FormatFullTopicTest(unittest.TestCase):
+	def test_topic_first(self):
+		self.assertEqual(format_full_topic(TOPIC_FIRST, "sonoff", "cmnd", "2"), "sonoff/cmnd/POWER2")
+
+	def test_prefix_first(self):
+		self.assertEqual(format_full_topic(PREFIX_FIRST, "sonoff", "stat", ""), "stat/sonoff/POWER")
+
+	def test_extra_levels(self):
+		self.assertEqual(format_full_topic(EXTRA_LEVELS, "sonoff", "stat", "1"), "home/stat/tasmota/sonoff/POWER1")
+
+	def test_device_command(self):
+		self.assertEqual(format_full_topic(PREFIX_FIRST, "sonoff", "tele", "", command="LWT"), "tele/sonoff/LWT")
+
+
+class TopicMatcherTest(unittest.TestCase):
+	def test_subscription(self):
+		self.assertEqual(TopicMatcher(TOPIC_FIRST, "stat").subscription, "+/stat/+")
+		self.assertEqual(TopicMatcher(PREFIX_FIRST, "stat").subscription, "stat/+/+")
+		self.assertEqual(TopicMatcher(EXTRA_LEVELS, "stat").subscription, "home/stat/tasmota/+/+")
+		self.assertEqual(TopicMatcher(PREFIX_FIRST, "stat", command="RESULT", indexed=False).subscription, "stat/+/RESULT")
+
+	def test_match_topic_first(self):
+		matcher = TopicMatcher(TOPIC_FIRST, "stat")
+		self.assertEqual(matcher.match("sonoff/stat/POWER2"), ("sonoff", "2"))
+		self.assertEqual(matcher.match("sonoff/stat/POWER"), ("sonoff", ""))
+
+	def test_match_prefix_first(self):
+		matcher = TopicMatcher(PREFIX_FIRST, "stat")
+		self.assertEqual(matcher.match("stat/sonoff/POWER1"), ("sonoff", "1"))
+		self.assertIsNone(matcher.match("sonoff/stat/POWER1"))
+
+	def test_match_extra_levels(self):
+		matcher = TopicMatcher(EXTRA_LEVELS, "stat")
+		self.assertEqual(matcher.match("home/stat/tasmota/sonoff/POWER3"), ("sonoff", "3"))
+		self.assertIsNone(matcher.match("home/stat/other/sonoff/POWER3"))
+
+	def test_no_match_for_other_commands_and_prefixes(self):
+		matcher = TopicMatcher(TOPIC_FIRST, "stat")
+		self.assertIsNone(matcher.match("sonoff/stat/RESULT"))
+		self.assertIsNone(matcher.match("sonoff/tele/POWER1"))
+
+	def test_match_device_level(self):
+		matcher = TopicMatcher(PREFIX_FIRST, "tele", command="LWT", indexed=False)
+		self.assertEqual(matcher.match("tele/sonoff/LWT"), ("sonoff", ""))
+		self.assertIsNone(matcher.match("tele/sonoff/LWT1"))
+
+
+class RegistryFullTopicTest(unittest.TestCase):
+	def test_orderings(self):
+		for pattern, expected in ((TOPIC_FIRST, "sonoff/cmnd/POWER2"),
+								  (PREFIX_FIRST, "cmnd/sonoff/POWER2"),
+								  (EXTRA_LEVELS, "home/cmnd/tasmota/sonoff/POWER2")):
+			registry = RelayRegistry()
+			registry.rebuild([relay("sonoff", "2")], pattern)
+			self.assertEqual(registry.full_topic(registry.get("sonoff", "2"), "cmnd"), expected)
+			self.assertEqual(registry.by_stat_topic(expected.replace("cmnd", "stat")), registry.get("sonoff", "2"))
+
+	def test_cached_topics_survive_rebuild(self):
+		registry = RelayRegistry()
+		registry.rebuild([relay("sonoff", "1")], TOPIC_FIRST)
+		cached = registry._topics[("sonoff", "1")]
+		registry.rebuild([relay("sonoff", "1")], TOPIC_FIRST)
+		self.assertIs(registry._topics[("sonoff", "1")], cached)
+
+	def test_pattern_change_invalidates(self):
+		registry = RelayRegistry()
+		registry.rebuild([relay("sonoff", "1")], TOPIC_FIRST)
+		registry.device_topic("sonoff", "cmnd", "Backlog")
+		registry.rebuild([relay("sonoff", "1")], PREFIX_FIRST)
+		self.assertEqual(registry.full_topic(registry.get("sonoff", "1"), "stat"), "stat/sonoff/POWER1")
+		self.assertEqual(registry.device_topic("sonoff", "cmnd", "Backlog"), "cmnd/sonoff/Backlog")
+		self.assertIsNone(registry.by_stat_topic("sonoff/stat/POWER1"))
+
+	def test_topic_and_relay_change_invalidates(self):
+		registry = RelayRegistry()
+		registry.rebuild([relay("sonoff", "1")], TOPIC_FIRST)
+		registry.rebuild([relay("plug", "2")], TOPIC_FIRST)
+		self.assertEqual(registry.full_topic(registry.get("plug", "2"), "cmnd"), "plug/cmnd/POWER2")
+		self.assertNotIn(("sonoff", "1"), registry._topics)
+		self.assertIsNone(registry.by_stat_topic("sonoff/stat/POWER1"))
+
+
+if __name__ == "__main__":
+	unittest.main()